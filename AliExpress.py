@@ -1,172 +1,711 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
+import os
+import threading
+import time
+from urllib.parse import urlsplit
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 import json
 import logging
-from rich import print
+
+from event_store import EventStore
+from fragment_cache import fragments
+from location_classifier import classifier
+from metrics import metrics
+from single_flight import SingleFlight
+from tracking_cache import TrackingCache
+from tracking_parser import parse_tracking_page
+from upstream_guard import CircuitBreaker, CircuitOpenError, RetryBudget, TokenBucket, backoff_delay, is_retryable
+
+try:
+    import orjson  # optional, faster JSON Lines output
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
 
-def fetch_package_updates(packages, output_file="packages_updates.json", show_only_updates=True):
-    base_url = "http://www.rapidposte.poste.tn/fr/Item_Events.asp?ItemId="
-    results = []
-    total_packages = len(packages)
-    found_updates = 0
-    in_tunisia = 0
-    on_the_way = 0
-    show_delivered = False
-    packages_in_tunisia = {"Ghazala": [], "Ariana": [], "Tunis": []}
-    packages_in_tunisia_not_delivered = {"Ghazala": [], "Ariana": [], "Tunis": []}
-    packages_on_the_way = []
+def print(*args, **kwargs):
+    """rich's print, imported on first use: only the desktop output prints"""
+    from rich import print as rich_print
+    rich_print(*args, **kwargs)
 
-    print(f"{total_packages} packages to check found\n")
 
-    for idx, pkg in enumerate(packages, start=1):
-        pkg_number_original = pkg["package_number"]
-        pkg_items = pkg.get("package orders", [])
+BASE_URL = os.environ.get("RAPIDPOSTE_BASE_URL", "http://www.rapidposte.poste.tn/fr/Item_Events.asp?ItemId=")
+
+# Defaults for the concurrent fetch engine
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_PER_HOST_LIMIT = 4
+
+# One User-Agent for every fetch path (desktop and mobile used to differ)
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'
+DEFAULT_POOL_SIZE = int(os.environ.get("TRACKER_POOL_SIZE", "10"))
+
+DATE_FORMAT = "%d/%m/%Y %H:%M:%S"
+NO_UPDATE = "no package update"
+FETCH_ERROR = "fetch error"
+
+
+@dataclass(slots=True)
+class TrackingEvent:
+    """One row of the events table, with its date parsed once"""
+    date: str
+    pays: str
+    lieu: str
+    event: str
+    timestamp: int | None  # epoch seconds, None if the date is malformed
+
+    @classmethod
+    def from_update(cls, update):
+        try:
+            timestamp = int(datetime.strptime(update["Date"], DATE_FORMAT).timestamp())
+        except ValueError:
+            timestamp = None
+        return cls(update["Date"], update["Pays"], update["Lieu"], update["Type d'événement"], timestamp)
+
+    def to_dict(self):
+        return {
+            "Date": self.date,
+            "Pays": self.pays,
+            "Lieu": self.lieu,
+            "Type d'événement": self.event
+        }
+
+
+@dataclass(slots=True)
+class PackageStatus:
+    """Classified state of one package.
+
+    ``events`` is None when no candidate number had tracking events; if
+    that is because every request failed, ``error`` holds the reason so the
+    package is reported as a fetch error rather than "no package update".
+    The location and delivered flags are computed once, when the status is
+    built, and ``to_dict()`` gives the JSON result entry.
+    """
+    idx: int | None
+    package_number: str
+    orders: list
+    events: list | None
+    location: str = ""
+    delivered: bool = False
+    latest_office: str | None = None
+    is_today: bool = False
+    new_updates: int = 0
+    error: str | None = None
+
+    @classmethod
+    @metrics.timed("stage_seconds", stage="classify")
+    def from_fetch(cls, idx, package_number, orders, updates, now=None, error=None):
+        if updates is None:
+            return cls(idx, package_number, orders, None, error=error)
+
+        events = [TrackingEvent.from_update(u) for u in updates]
+        # Location by office priority (Ghazala > Ariana > Tunis by default)
+        found = classifier.classify(events)
+
+        is_today = False
+        if events and events[-1].timestamp is not None:
+            now = now or datetime.now()
+            today_start = int(now.replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+            is_today = today_start <= events[-1].timestamp < today_start + 86400
+        return cls(idx, package_number, orders, events, found.location, found.delivered,
+                   found.latest_office, is_today)
+
+    @property
+    def has_updates(self):
+        return self.events is not None
+
+    @property
+    def last_update_date(self):
+        return self.events[-1].date if self.events else None
+
+    def days_since(self, event, now=None):
+        if event.timestamp is None:
+            return 0
+        now = now or datetime.now()
+        return int((now.timestamp() - event.timestamp) // 86400)
+
+    def updates(self):
+        """The events as the French-keyed dicts used in JSON output"""
+        if self.events is None:
+            return FETCH_ERROR if self.error else NO_UPDATE
+        return [e.to_dict() for e in self.events]
+
+    def to_dict(self):
+        result = {} if self.idx is None else {"n°": self.idx}
+        result.update({
+            "package_number": self.package_number,
+            "orders": self.orders
+        })
+        if self.events is None:
+            if self.error:
+                result["error"] = self.error
+            result["updates"] = self.updates()
+            return result
+        result.update({
+            "n° of updates": len(self.events),
+            "location": self.location,
+            "latest_office": self.latest_office,
+            "delivered": self.delivered,
+            "last_update_date": self.last_update_date,
+            "is_today": self.is_today,
+            "days since first update": self.days_since(self.events[0]) if self.events else 0,
+            "days since last update": self.days_since(self.events[-1]) if self.events else 0,
+            "new updates": self.new_updates,
+            "updates": self.updates()
+        })
+        return result
+
+
+_session = None
+_session_lock = threading.Lock()
+
+# Upstream protection: at most TRACKER_RATE_LIMIT requests per second,
+# up to TRACKER_MAX_RETRIES jittered retries per request within a global
+# retry budget, and a circuit breaker that fails fast after
+# TRACKER_BREAKER_THRESHOLD consecutive requests that could not reach
+# rapidposte at all (after their retries).
+MAX_RETRIES = int(os.environ.get("TRACKER_MAX_RETRIES", "2"))
+rate_limiter = TokenBucket(float(os.environ.get("TRACKER_RATE_LIMIT", "5")))
+retry_budget = RetryBudget()
+circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("TRACKER_BREAKER_THRESHOLD", "5")),
+    reset_timeout=int(os.environ.get("TRACKER_BREAKER_RESET", "60"))
+)
+
+_event_store = None
+_event_store_lock = threading.Lock()
+
+# Alternates of split "A/B" entries are fetched on their own pool so a
+# package worker never waits on a thread from its own pool.
+_race_executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS * 2, thread_name_prefix="race")
+_preferred_alternates = {}
+
+# Overlapping scans and /check calls share one fetch per package
+_package_flights = SingleFlight()
+
+# Parsed pages are reused for TRACKER_CACHE_TTL seconds; delivered packages
+# are kept forever. Set TRACKER_CACHE_FILE to keep the cache across restarts.
+response_cache = TrackingCache(
+    ttl=int(os.environ.get("TRACKER_CACHE_TTL", "300")),
+    max_entries=int(os.environ.get("TRACKER_CACHE_SIZE", "2000")),
+    path=os.environ.get("TRACKER_CACHE_FILE") or None
+)
+
+
+def get_session(pool_size=DEFAULT_POOL_SIZE):
+    """Return the long-lived HTTP session shared by all fetch paths.
+
+    The session keeps connections to rapidposte alive between requests, so a
+    full scan reuses a small pool of sockets instead of opening one per
+    tracking number. ``pool_size`` only applies when the session is created.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, int(pool_size)))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({
+                'User-Agent': USER_AGENT,
+                'Connection': 'keep-alive'
+            })
+            _session = session
+        return _session
+
+
+def get_event_store():
+    """Return the shared event store, or None if TRACKER_EVENT_DB is empty"""
+    global _event_store
+    path = os.environ.get("TRACKER_EVENT_DB", "package_events.db")
+    if not path:
+        return None
+    with _event_store_lock:
+        if _event_store is None:
+            _event_store = EventStore(path)
+        return _event_store
+
+
+def _record_events(statuses):
+    """Store the events of a scan and set each status's new-event count.
+
+    Returns the ``{package_number: [new updates]}`` delta of this scan.
+    """
+    store = get_event_store()
+    if store is None:
+        return {}
+    delta = store.record_scan({s.package_number: s.updates() for s in statuses if s.has_updates})
+    for s in statuses:
+        s.new_updates = len(delta.get(s.package_number, []))
+    return delta
+
+
+def _event_recorder():
+    """Return ``record(status)``, which stores one package's events as soon as
+    it is fetched and sets its new-event count; all of them form one scan"""
+    store = get_event_store()
+    if store is None:
+        return lambda status: None
+    scan_id = store.start_scan()
+
+    def record(status):
+        if status.has_updates:
+            status.new_updates = len(store.record_package(scan_id, status.package_number, status.updates()))
+
+    return record
+
+
+def _json_line(record):
+    """``record`` as one UTF-8 JSON Lines entry, encoded by orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(record) + b"\n"
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _preferred_alternate(pkg_number_original):
+    """Return the alternate of an "A/B" entry that answered last time"""
+    if "/" not in pkg_number_original:
+        return None
+    if pkg_number_original not in _preferred_alternates:
+        store = get_event_store()
+        _preferred_alternates[pkg_number_original] = (
+            store.preferred_alternate(pkg_number_original) if store else None
+        )
+    return _preferred_alternates[pkg_number_original]
+
+
+def _remember_alternate(pkg_number_original, tracking_number):
+    _preferred_alternates[pkg_number_original] = tracking_number
+    store = get_event_store()
+    if store:
+        store.set_preferred_alternate(pkg_number_original, tracking_number)
+
 
-        print(f"Checking package n°{idx} : {pkg_number_original}")
+def close_session():
+    """Close the shared session and its pooled connections"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
 
-        pkg_numbers_to_try = [pkg_number_original]
-        if "/" in pkg_number_original:
-            pkg_numbers_to_try = pkg_number_original.split('/')
 
-        soup = None
-        pkg_number = None
+class FetchEngine:
+    """Fetch packages on a bounded thread pool.
 
-        for attempt in pkg_numbers_to_try:
-            url = base_url + attempt
+    ``max_workers`` caps how many packages are in flight at once and
+    ``per_host_limit`` caps concurrent requests to a single host, so a long
+    list never hammers rapidposte with more than that many connections.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT):
+        self.max_workers = max(1, int(max_workers))
+        self.per_host_limit = max(1, int(per_host_limit))
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def host_slot(self, url):
+        """Hold one of the in-flight slots for the host of ``url``"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_slots[host] = slot
+        with slot:
+            yield
+
+    def iter_completed(self, fn, items):
+        """Apply ``fn`` to every item concurrently.
+
+        Yields ``(index, result)`` pairs as soon as each call finishes.
+        Closing the generator early cancels the calls that have not started.
+        """
+        items = list(items)
+        if not items:
+            return
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(items)),
+                                      thread_name_prefix="fetch")
+        try:
+            futures = {executor.submit(fn, item): i for i, item in enumerate(items)}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _get_page(engine, session, url, timeout):
+    """GET ``url`` through the rate limiter, retry budget and circuit breaker.
+
+    The breaker gets one outcome per call, once the retries are over: a
+    failure if the last attempt got no answer (timeout or connection error),
+    a success otherwise. An HTTP error, even a 5xx for one item, still
+    means rapidposte is up.
+    """
+    if not circuit_breaker.allow():
+        metrics.inc("upstream_requests_total", outcome="circuit_open")
+        raise CircuitOpenError("rapidposte is failing, not sending requests for now")
+    retry_budget.record_attempt()
+    retries = 0
+    answered = False
+    try:
+        while True:
+            rate_limiter.acquire()
+            answered = False
             try:
                 logger.info(f"Fetching URL: {url}")
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }
-                response = requests.get(url, headers=headers, timeout=30)
+                with engine.host_slot(url), metrics.timer("stage_seconds", stage="network"):
+                    response = session.get(url, timeout=timeout)
+                answered = True
                 logger.info(f"Response status: {response.status_code}, length: {len(response.text)}")
                 response.raise_for_status()
-                
-                temp_soup = BeautifulSoup(response.text, "html.parser")
-                if temp_soup.find("table", {"id": "200"}):
-                    soup = temp_soup
-                    pkg_number = attempt
-                    print(f"  → Found updates with {pkg_number}")
-                    break
-                else:
-                    print(f"  → No updates for {attempt}")
             except requests.RequestException as e:
-                logger.error(f"Error fetching {attempt}: {e}")
-                print(f"  ⚠ Error fetching {attempt}: {e}")
-        
-        if not soup:
-            print("  → no package update\n")
-            results.append({
-                "n°": idx,
-                "package_number": pkg_number_original,
-                "orders": pkg_items,
-                "updates": "no package update"
-            })
-            continue
+                metrics.inc("upstream_requests_total", outcome=_request_outcome(e))
+                if not is_retryable(e) or retries >= MAX_RETRIES or not retry_budget.try_spend():
+                    raise
+                retries += 1
+                metrics.inc("upstream_retries_total")
+                delay = backoff_delay(retries)
+                logger.warning(f"Retrying {url} in {delay:.1f}s after: {e}")
+                time.sleep(delay)
+                continue
+            metrics.inc("upstream_requests_total", outcome="ok")
+            return response
+    finally:
+        # Always end the call for the breaker, or a trial request never ends
+        if answered:
+            circuit_breaker.record_success()
+        else:
+            circuit_breaker.record_failure()
 
-        table = soup.find("table", {"id": "200"})
 
-        print("  → package updates found\n")
-        found_updates += 1
+def _request_outcome(error):
+    """Short label for a failed request, used in the metrics"""
+    if isinstance(error, requests.Timeout):
+        return "timeout"
+    if isinstance(error, requests.ConnectionError):
+        return "connection_error"
+    response = getattr(error, "response", None)
+    if response is not None:
+        return f"http_{response.status_code}"
+    return "error"
 
-        updates = []
-        rows = table.find_all("tr")[2:]  # skip header rows
 
-        for row in rows:
-            cols = row.find_all("td")
-            if len(cols) < 4:
-                continue
-            date = cols[0].get_text(strip=True)
-            pays = cols[1].get_text(strip=True)
-            lieu = cols[2].get_text(strip=True)
-            event = cols[3].get_text(strip=True)
-
-            updates.append({
-                "Date": date,
-                "Pays": pays,
-                "Lieu": lieu,
-                "Type d'événement": event
-            })
+def _fetch_candidate(engine, session, attempt, timeout):
+    """Fetch one tracking number. Returns ``(updates, outcome)``."""
+    try:
+        response = _get_page(engine, session, BASE_URL + attempt, timeout)
+    except requests.RequestException as e:
+        logger.error(f"Error fetching {attempt}: {e}")
+        return None, e
 
-        # Determine location priority: Ghazala > Ariana > Tunis
-        location = ""
-        last_update_date = updates[-1]["Date"] if updates else None
-        is_today = datetime.now().strftime("%d/%m/%Y") == datetime.strptime(last_update_date, "%d/%m/%Y %H:%M:%S").strftime("%d/%m/%Y") if last_update_date else False
-        if any("Livré" in u["Type d'événement"] for u in updates):
-            delivered = True
-        else:
-            delivered = False
-        data = {
-            "package_number": pkg_number,
-            "orders": pkg_items,
-            "last_update_date": last_update_date,
-            "delivered": delivered,
-            "is_today": is_today
-        }
-        if any("ghazala" in u["Lieu"].lower() for u in updates):
-            location = "Ghazala"
-            in_tunisia += 1
-            packages_in_tunisia[location].append(data)
-            if not delivered:
-                packages_in_tunisia_not_delivered[location].append(data)
-        elif any("ariana" in u["Lieu"].lower() for u in updates):
-            location = "Ariana"
-            in_tunisia += 1
-            packages_in_tunisia[location].append(data)
-            if not delivered:
-                packages_in_tunisia_not_delivered[location].append(data)
-        elif any("tunis" in u["Lieu"].lower() for u in updates):
-            location = "Tunis"
-            in_tunisia += 1
-            packages_in_tunisia[location].append(data)
-            if not delivered:
-                packages_in_tunisia_not_delivered[location].append(data)
+    with metrics.timer("stage_seconds", stage="parse"):
+        updates = parse_tracking_page(response.text)
+    return updates, "found" if updates is not None else "empty"
+
+
+def _race_candidates(engine, session, candidates, timeout):
+    """Fetch alternate numbers concurrently; the first one with events wins.
+
+    Returns ``(winner, updates, attempts)`` where ``winner`` is None if no
+    candidate had events. Requests still queued when a winner is found are
+    cancelled, and the results of those already running are ignored.
+    """
+    if len(candidates) == 1:
+        updates, outcome = _fetch_candidate(engine, session, candidates[0], timeout)
+        winner = candidates[0] if outcome == "found" else None
+        return winner, updates, [(candidates[0], outcome)]
+
+    futures = {
+        _race_executor.submit(_fetch_candidate, engine, session, candidate, timeout): candidate
+        for candidate in candidates
+    }
+    attempts = []
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            updates, outcome = future.result()
+            attempts.append((futures[future], outcome))
+            if outcome == "found":
+                for other in pending:
+                    other.cancel()
+                return futures[future], updates, attempts
+    return None, None, attempts
+
+
+def _fetch_package(engine, pkg_number_original, timeout, use_cache=True, max_age=None):
+    """Fetch a package, joining a fetch of the same package already in flight.
+
+    Only a fetch with the same cache policy is joined: a /check must not get
+    the result of a background poll that accepts cache entries of any age.
+    See ``_fetch_package_now`` for the arguments and return value.
+    """
+    return _package_flights.do(
+        (pkg_number_original, use_cache, max_age),
+        lambda: _fetch_package_now(engine, pkg_number_original, timeout, use_cache, max_age)
+    )
+
+
+def _fetch_package_now(engine, pkg_number_original, timeout, use_cache=True, max_age=None):
+    """Find the candidate number of a package that has an events table.
+
+    Split "A/B" entries are raced concurrently, except that the alternate
+    which answered last time is tried on its own first.
+
+    Returns ``(pkg_number, updates, attempts)``. ``updates`` is None when no
+    candidate had tracking events, and ``attempts`` lists ``(number, outcome)``
+    pairs where outcome is "found", "empty", "cached" or the request error.
+    Results are served from and stored in ``response_cache`` unless
+    ``use_cache`` is False; results with request errors are never cached.
+    ``max_age`` overrides the cache TTL for the lookup.
+    """
+    if use_cache:
+        cached = response_cache.get(pkg_number_original, max_age=max_age)
+        metrics.inc("cache_lookups_total", result="miss" if cached is None else "hit")
+        if cached is not None:
+            pkg_number, updates = cached
+            return pkg_number, updates, [(pkg_number, "cached")]
+
+    candidates = pkg_number_original.split('/')
+    session = get_session()
+    attempts = []
+    winner = None
+
+    preferred = _preferred_alternate(pkg_number_original)
+    if preferred in candidates and len(candidates) > 1:
+        winner, updates, attempts = _race_candidates(engine, session, [preferred], timeout)
+        candidates = [c for c in candidates if c != preferred]
+    if winner is None:
+        winner, updates, more_attempts = _race_candidates(engine, session, candidates, timeout)
+        attempts += more_attempts
+
+    if winner is not None:
+        if "/" in pkg_number_original and winner != preferred:
+            _remember_alternate(pkg_number_original, winner)
+        response_cache.put(pkg_number_original, winner, updates)
+        return winner, updates, attempts
+
+    if all(outcome == "empty" for _, outcome in attempts):
+        response_cache.put(pkg_number_original, pkg_number_original, None)
+    return pkg_number_original, None, attempts
+
+
+def _iter_fetched(packages, timeout, max_workers, per_host_limit, use_cache=True, planner=None):
+    """Yield ``(idx, pkg, (pkg_number, updates, attempts))`` as fetches complete.
+
+    ``idx`` is the 1-based position of the package in ``packages``. With a
+    ``planner``, packages that are not due yet are answered from the cache
+    whatever its age, so only due packages hit the network.
+    """
+    engine = FetchEngine(max_workers=max_workers, per_host_limit=per_host_limit)
+    now = time.time()
+
+    def fetch_one(pkg):
+        max_age = None
+        if planner is not None and not planner.is_due(pkg["package_number"], now):
+            max_age = float("inf")
+        return _fetch_package(engine, pkg["package_number"], timeout, use_cache, max_age)
+
+    fetched = engine.iter_completed(fetch_one, packages)
+    for i, result in fetched:
+        yield i + 1, packages[i], result
+
+
+def iter_package_results(packages, timeout=5, max_workers=DEFAULT_MAX_WORKERS,
+                         per_host_limit=DEFAULT_PER_HOST_LIMIT, use_cache=True, planner=None):
+    """Yield each package's ``PackageStatus`` as soon as its page is parsed.
+
+    Results arrive in completion order, not list order; use the ``idx``
+    field to put them back in ``package_list.json`` order. If a
+    ``PollingPlanner`` is given, only due packages are fetched and each
+    fresh result is used to plan that package's next check.
+    """
+    fetched = _iter_fetched(packages, timeout, max_workers, per_host_limit, use_cache, planner)
+    for idx, pkg, (pkg_number, updates, attempts) in fetched:
+        status = PackageStatus.from_fetch(idx, pkg_number, pkg.get("package orders", []), updates,
+                                          error=_fetch_error(updates, attempts))
+        if planner is not None and _fetched_cleanly(attempts):
+            planner.schedule(pkg["package_number"], status)
+        yield status
+
+
+def _fetched_cleanly(attempts):
+    """True if a result came from the network without request errors"""
+    return all(outcome in ("found", "empty") for _, outcome in attempts)
+
+
+def _fetch_error(updates, attempts):
+    """Return the error message if every attempt for a package failed"""
+    if updates is not None or not attempts:
+        return None
+    if any(outcome in ("found", "empty", "cached") for _, outcome in attempts):
+        return None
+    return str(attempts[-1][1])
+
+
+def _group_results(statuses):
+    """Sort packages with updates into the Tunisia and on-the-way groups"""
+    packages_in_tunisia = {office: [] for office in classifier.office_names}
+    packages_in_tunisia_not_delivered = {office: [] for office in classifier.office_names}
+    packages_on_the_way = []
+
+    for s in statuses:
+        if not s.has_updates:
+            continue
+        if s.location in packages_in_tunisia:
+            data = {
+                "package_number": s.package_number,
+                "orders": s.orders,
+                "last_update_date": s.last_update_date,
+                "delivered": s.delivered,
+                "is_today": s.is_today,
+                "new_updates": s.new_updates
+            }
+            packages_in_tunisia[s.location].append(data)
+            if not s.delivered:
+                packages_in_tunisia_not_delivered[s.location].append(data)
         else:
-            location = "on the way"
-            on_the_way += 1
             packages_on_the_way.append({
-                "package_number": pkg_number,
-                "orders": pkg_items,
-                "last_update_date": last_update_date,
-                "is_today": is_today
+                "package_number": s.package_number,
+                "orders": s.orders,
+                "last_update_date": s.last_update_date,
+                "is_today": s.is_today,
+                "new_updates": s.new_updates
             })
 
-        results.append({
-            "n°": idx,
-            "package_number": pkg_number,
-            "orders": pkg_items,
-            "n° of updates": len(updates),
-            "location": location,
-            "delivered": delivered,
-            "days since first update": (
-            (datetime.now() - datetime.strptime(updates[0]["Date"], "%d/%m/%Y %H:%M:%S")).days
-            if updates else 0
-            ),
-            "days since last update": (
-            (datetime.now() - datetime.strptime(updates[-1]["Date"], "%d/%m/%Y %H:%M:%S")).days
-            if updates else 0
-            ),
-            "updates": updates
-        })
+    return packages_in_tunisia, packages_in_tunisia_not_delivered, packages_on_the_way
+
+
+def _print_attempts(idx, pkg, updates, attempts):
+    print(f"Checking package n°{idx} : {pkg['package_number']}")
+    for attempt, outcome in attempts:
+        if outcome == "found":
+            print(f"  → Found updates with {attempt}")
+        elif outcome == "cached":
+            print(f"  → Using cached result for {attempt}")
+        elif outcome == "empty":
+            print(f"  → No updates for {attempt}")
+        else:
+            print(f"  ⚠ Error fetching {attempt}: {outcome}")
+    if updates is not None:
+        print("  → package updates found\n")
+    elif _fetch_error(updates, attempts):
+        print("  → fetch error\n")
+    else:
+        print("  → no package update\n")
+
+
+def _desktop_entry(p, order_cut, with_delivered=False):
+    """Log entry of a package with updates, re-rendered only when its state changed"""
+    delivered = with_delivered and p['delivered']
+    return fragments.render(
+        "desktop", (p['package_number'], tuple(p['orders'])),
+        (p['last_update_date'], p['is_today'], p['new_updates'], delivered, order_cut),
+        lambda: _render_desktop_entry(p, order_cut, delivered)
+    )
+
+
+def _render_desktop_entry(p, order_cut, delivered):
+    orders = f"\t{p['package_number']}"
+    first_order = p['orders'][0][:order_cut]+"..."
+    orders += f"\t|\t{first_order.ljust(order_cut+3)}"
+    orders += f"\t|\t{p['last_update_date']}"
+    if delivered:
+        orders += f"\t|\t✅ Delivered ✅"
+    if p['is_today']:
+        orders += f"\t|\t✨ Today ✨"
+    if p['new_updates']:
+        orders += f"\t|\t🆕 {p['new_updates']} new"
+    if len(p['orders']) > 1:
+        for o in p['orders'][1:]:
+            orders += f"\n\t\t\t\t\t\t{o[:order_cut]}..."
+    return orders
+
+
+@metrics.timed("stage_seconds", stage="scan")
+def fetch_package_updates(packages, output_file="packages_updates.json", show_only_updates=True,
+                          max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                          use_cache=True, stream=False, quiet=False):
+    """Check every package, print and save the results and the summary log.
+
+    By default ``output_file`` gets one indented JSON list once all the
+    packages are checked. With ``stream`` it is written as JSON Lines
+    instead: each package's record (with its "n°") is appended as soon as
+    the package is fetched, so records come in completion order, and only
+    what the summary log needs is kept in memory; the returned
+    ``with_update`` and ``no_update`` lists are then empty. ``quiet`` skips
+    the per-package console output; the summary is still printed.
+    """
+    total_packages = len(packages)
+    show_delivered = False
+
+    print(f"{total_packages} packages to check found\n")
+
+    # Print each package as soon as it is fetched, then restore list order
+    statuses = []
+    stream_file = open(output_file, "wb") if stream else None
+    record_events = _event_recorder() if stream else None
+    try:
+        fetched = _iter_fetched(packages, 30, max_workers, per_host_limit, use_cache)
+        for idx, pkg, (pkg_number, updates, attempts) in fetched:
+            if not quiet:
+                _print_attempts(idx, pkg, updates, attempts)
+            status = PackageStatus.from_fetch(idx, pkg_number, pkg.get("package orders", []), updates,
+                                              error=_fetch_error(updates, attempts))
+            if stream:
+                record_events(status)
+                record = status.to_dict()
+                stream_file.write(_json_line(record))
+                if not quiet and (status.has_updates or not show_only_updates):
+                    print(json.dumps(record, indent=4, ensure_ascii=False))
+                    print()
+                # The history is in the file now; the summary only needs the last event's date
+                if status.events:
+                    status.events = status.events[-1:]
+            statuses.append(status)
+    finally:
+        if stream_file:
+            stream_file.close()
+    statuses.sort(key=lambda s: s.idx)
+    response_cache.save()
+    if not stream:
+        _record_events(statuses)
+
+    packages_in_tunisia, packages_in_tunisia_not_delivered, packages_on_the_way = _group_results(statuses)
+    found_updates = sum(1 for s in statuses if s.has_updates)
+    in_tunisia = sum(len(pkgs) for pkgs in packages_in_tunisia.values())
+    on_the_way = len(packages_on_the_way)
 
     # Print summary
 
-    # Save to JSON file
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=4, ensure_ascii=False)
+    no_update_statuses = [s for s in statuses if not s.has_updates and not s.error] if show_only_updates else []
+    if stream:
+        with_update, no_update = [], []
+    else:
+        results = [s.to_dict() for s in statuses]
+
+        # Save to JSON file
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4, ensure_ascii=False)
 
-    if show_only_updates:
-        with_update = [res for res in results if res["updates"] != "no package update"]
-        no_update = [res for res in results if res["updates"] == "no package update"]
+        if show_only_updates:
+            with_update = [res for res in results if isinstance(res["updates"], list)]
+            no_update = [res for res in results if res["updates"] == NO_UPDATE]
+        else:
+            with_update = results
+            no_update = []
 
-    # Print results
-    for res in with_update:
-        print(json.dumps(res, indent=4, ensure_ascii=False))
-        print()
+        # Print results
+        if not quiet:
+            for res in with_update:
+                print(json.dumps(res, indent=4, ensure_ascii=False))
+                print()
 
     # print & save all the logs below to a log file at the same time
     log_output = []
@@ -183,295 +722,158 @@ def fetch_package_updates(packages, output_file="packages_updates.json", show_on
             log_output.append(separator)
             # first_order = None
         for p in pkgs:
-            orders = f"\t{p['package_number']}"
-            first_order = p['orders'][0][:order_cut]+"..."
-            orders += f"\t|\t{first_order.ljust(order_cut+3)}"
-            orders += f"\t|\t{p['last_update_date']}"
-            if p['delivered']:
-                orders += f"\t|\t✅ Delivered ✅"
-            if p['is_today']:
-                orders += f"\t|\t✨ Today ✨"
-            if len(p['orders']) > 1:
-                for o in p['orders'][1:]:
-                    orders += f"\n\t\t\t\t\t\t{o[:order_cut]}..."
-            log_output.append(orders)
+            log_output.append(_desktop_entry(p, order_cut, with_delivered=True))
             log_output.append(separator)
             
     log_output.append(f"\n - On the way: {on_the_way} packages")
     if packages_on_the_way:
         log_output.append(separator)
     for p in packages_on_the_way:
-        orders = f"\t{p['package_number']}"
-        first_order = p['orders'][0][:order_cut]+"..."
-        orders += f"\t|\t{first_order.ljust(order_cut+3)}"
-        orders += f"\t|\t{p['last_update_date']}"
-        if p['is_today']:
-            orders += f"\t|\t✨ Today ✨"
-        if len(p['orders']) > 1:
-            for o in p['orders'][1:]:
-                orders += f"\n\t\t\t\t\t\t{o[:order_cut]}..."
-        log_output.append(orders)
+        log_output.append(_desktop_entry(p, order_cut))
         log_output.append(separator) 
         
-    log_output.append(f"\n - No updates: {len(no_update)} packages")
-    if no_update:
+    log_output.append(f"\n - No updates: {len(no_update_statuses)} packages")
+    if no_update_statuses:
+        log_output.append(separator)
+    for s in no_update_statuses:
+        log_output.append(f"\t{(s.orders[0][:order_cut] + '...').ljust(order_cut+3)}\t|\t{s.package_number}")
+        log_output.append(separator)
+
+    fetch_errors = [s for s in statuses if not s.has_updates and s.error]
+    if fetch_errors:
+        log_output.append(f"\n - Fetch errors: {len(fetch_errors)} packages")
         log_output.append(separator)
-    for res in no_update:
-        log_output.append(f"\t{(res['orders'][0][:order_cut] + '...').ljust(order_cut+3)}\t|\t{res['package_number']}")
+    for s in fetch_errors:
+        log_output.append(f"\t{(s.orders[0][:order_cut] + '...').ljust(order_cut+3)}\t|\t{s.package_number}\t|\t⚠ {s.error}")
         log_output.append(separator)
 
-    print("\n".join(log_output))
+    # One line at a time: rich renders a single huge string all at once
+    for line in log_output:
+        print(line)
     with open("update_log.txt", "w", encoding="utf-8") as log_file:
         log_file.write("\n".join(log_output))
 
     return with_update, no_update, log_output
 
 
-def create_mobile_output(packages, show_only_updates=True):
-    """Create mobile-friendly output format for Telegram bot"""
-    base_url = "http://www.rapidposte.poste.tn/fr/Item_Events.asp?ItemId="
-    results = []
-    total_packages = len(packages)
-    found_updates = 0
-    in_tunisia = 0
-    on_the_way = 0
-    show_delivered = False
-    packages_in_tunisia = {"Ghazala": [], "Ariana": [], "Tunis": []}
-    packages_in_tunisia_not_delivered = {"Ghazala": [], "Ariana": [], "Tunis": []}
-    packages_on_the_way = []
+@dataclass(slots=True)
+class MobileReport:
+    """Result of a mobile scan: the result lists, the rendered report and its parts.
 
-    for idx, pkg in enumerate(packages, start=1):
-        pkg_number_original = pkg["package_number"]
-        pkg_items = pkg.get("package orders", [])
+    ``summary`` and ``sections`` are what ``mobile_output`` is made of, kept
+    so the bot can render the report page by page.
+    """
+    with_update: list
+    no_update: list
+    mobile_output: list
+    summary: list
+    sections: list
 
-        pkg_numbers_to_try = [pkg_number_original]
-        if "/" in pkg_number_original:
-            pkg_numbers_to_try = pkg_number_original.split('/')
 
-        soup = None
-        pkg_number = None
+def create_mobile_output(packages, show_only_updates=True,
+                         max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                         progress=None, use_cache=True, planner=None):
+    """Create mobile-friendly output format for Telegram bot
 
-        for attempt in pkg_numbers_to_try:
-            url = base_url + attempt
-            try:
-                logger.info(f"Fetching URL: {url}")
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'
-                }
-                response = requests.get(url, headers=headers, timeout=5)
-                logger.info(f"Response status: {response.status_code}, length: {len(response.text)}")
-                response.raise_for_status()
-                
-                temp_soup = BeautifulSoup(response.text, "html.parser")
-                if temp_soup.find("table", {"id": "200"}):
-                    soup = temp_soup
-                    pkg_number = attempt
-                    break
-            except requests.RequestException:
-                continue
-        
-        if not soup:
-            results.append({
-                "n°": idx,
-                "package_number": pkg_number_original,
-                "orders": pkg_items,
-                "updates": "no package update"
-            })
-            continue
+    Returns ``(with_update, no_update, mobile_output)``; see
+    ``create_mobile_report`` for the arguments.
+    """
+    report = create_mobile_report(packages, show_only_updates, max_workers, per_host_limit,
+                                  progress, use_cache, planner)
+    return report.with_update, report.no_update, report.mobile_output
 
-        table = soup.find("table", {"id": "200"})
-        found_updates += 1
 
-        updates = []
-        rows = table.find_all("tr")[2:]  # skip header rows
+def create_mobile_report(packages, show_only_updates=True,
+                         max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                         progress=None, use_cache=True, planner=None):
+    """Scan ``packages`` and build the mobile report as a ``MobileReport``
 
-        for row in rows:
-            cols = row.find_all("td")
-            if len(cols) < 4:
-                continue
-            date = cols[0].get_text(strip=True)
-            pays = cols[1].get_text(strip=True)
-            lieu = cols[2].get_text(strip=True)
-            event = cols[3].get_text(strip=True)
-
-            updates.append({
-                "Date": date,
-                "Pays": pays,
-                "Lieu": lieu,
-                "Type d'événement": event
-            })
+    ``progress(done, total, status)`` is called with each ``PackageStatus``
+    as soon as it is classified, in completion order, so callers can show partial results
+    while the slow numbers are still in flight. ``planner`` is passed on to
+    ``iter_package_results`` so a scan only fetches the packages that are due.
+    """
+    statuses = scan_packages(packages, max_workers, per_host_limit, progress, use_cache, planner)
+    return build_mobile_report(statuses, show_only_updates)
 
-        # Determine location priority: Ghazala > Ariana > Tunis
-        location = ""
-        last_update_date = updates[-1]["Date"] if updates else None
-        is_today = datetime.now().strftime("%d/%m/%Y") == datetime.strptime(last_update_date, "%d/%m/%Y %H:%M:%S").strftime("%d/%m/%Y") if last_update_date else False
-        if any("Livré" in u["Type d'événement"] for u in updates):
-            delivered = True
-        else:
-            delivered = False
-        data = {
-            "package_number": pkg_number,
-            "orders": pkg_items,
-            "last_update_date": last_update_date,
-            "delivered": delivered,
-            "is_today": is_today
-        }
-        if any("ghazala" in u["Lieu"].lower() for u in updates):
-            location = "Ghazala"
-            in_tunisia += 1
-            packages_in_tunisia[location].append(data)
-            if not delivered:
-                packages_in_tunisia_not_delivered[location].append(data)
-        elif any("ariana" in u["Lieu"].lower() for u in updates):
-            location = "Ariana"
-            in_tunisia += 1
-            packages_in_tunisia[location].append(data)
-            if not delivered:
-                packages_in_tunisia_not_delivered[location].append(data)
-        elif any("tunis" in u["Lieu"].lower() for u in updates):
-            location = "Tunis"
-            in_tunisia += 1
-            packages_in_tunisia[location].append(data)
-            if not delivered:
-                packages_in_tunisia_not_delivered[location].append(data)
-        else:
-            location = "on the way"
-            on_the_way += 1
-            packages_on_the_way.append({
-                "package_number": pkg_number,
-                "orders": pkg_items,
-                "last_update_date": last_update_date,
-                "is_today": is_today
-            })
 
-        results.append({
-            "n°": idx,
-            "package_number": pkg_number,
-            "orders": pkg_items,
-            "n° of updates": len(updates),
-            "location": location,
-            "delivered": delivered,
-            "days since first update": (
-            (datetime.now() - datetime.strptime(updates[0]["Date"], "%d/%m/%Y %H:%M:%S")).days
-            if updates else 0
-            ),
-            "days since last update": (
-            (datetime.now() - datetime.strptime(updates[-1]["Date"], "%d/%m/%Y %H:%M:%S")).days
-            if updates else 0
-            ),
-            "updates": updates
-        })
+@metrics.timed("stage_seconds", stage="scan")
+def scan_packages(packages, max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                  progress=None, use_cache=True, planner=None):
+    """Fetch and classify ``packages``; returns their ``PackageStatus``es in list order.
+
+    The fetch half of ``create_mobile_report``: the cache is saved and the
+    new events recorded, so the statuses can be turned into reports for
+    any subset of the list with ``build_mobile_report``.
+    """
+    total_packages = len(packages)
+    statuses = []
+    for status in iter_package_results(packages, timeout=5, max_workers=max_workers,
+                                       per_host_limit=per_host_limit, use_cache=use_cache,
+                                       planner=planner):
+        statuses.append(status)
+        if progress:
+            progress(len(statuses), total_packages, status)
+    statuses.sort(key=lambda s: s.idx)
+    response_cache.save()
+    _record_events(statuses)
+    return statuses
+
+
+def build_mobile_report(statuses, show_only_updates=True):
+    """Build the ``MobileReport`` of already fetched ``statuses``"""
+    total_packages = len(statuses)
+    _, packages_in_tunisia_not_delivered, packages_on_the_way = _group_results(statuses)
+    found_updates = sum(1 for s in statuses if s.has_updates)
+    results = [s.to_dict() for s in statuses]
 
     if show_only_updates:
-        with_update = [res for res in results if res["updates"] != "no package update"]
-        no_update = [res for res in results if res["updates"] == "no package update"]
+        with_update = [res for res in results if isinstance(res["updates"], list)]
+        no_update = [res for res in results if res["updates"] == NO_UPDATE]
     else:
         with_update = results
         no_update = []
 
     # Use the new mobile formatter
-    from mobile_formatter import format_mobile_output
+    from mobile_formatter import format_report
     # Pass all results with updates to count delivered packages correctly
-    all_results_with_updates = [res for res in results if res["updates"] != "no package update"]
-    mobile_output = format_mobile_output(
+    all_results_with_updates = [res for res in results if isinstance(res["updates"], list)]
+    fetch_errors = [res for res in results if res["updates"] == FETCH_ERROR]
+    summary, sections, mobile_output = format_report(
         results=all_results_with_updates,
         packages_in_tunisia_not_delivered=packages_in_tunisia_not_delivered,
         packages_on_the_way=packages_on_the_way,
         total_packages=total_packages,
         found_updates=found_updates,
-        no_update=no_update
+        no_update=no_update,
+        fetch_errors=fetch_errors
     )
 
-    return with_update, no_update, mobile_output
+    return MobileReport(with_update, no_update, mobile_output, summary, sections)
+
 
+def fetch_single_package(tracking_number, package_orders=None, use_cache=True):
+    """Fetch detailed information for a single package including full tracking table.
 
-def fetch_single_package(tracking_number, package_orders=None):
-    """Fetch detailed information for a single package including full tracking table"""
+    Returns None if the package has no tracking events and raises the
+    request error if rapidposte could not be reached. The events are not
+    recorded in the event store: the next scan records them, so they still
+    count as new there and are notified.
+    """
     if package_orders is None:
         package_orders = []
     
-    base_url = "http://www.rapidposte.poste.tn/fr/Item_Events.asp?ItemId="
-    
-    pkg_numbers_to_try = [tracking_number]
-    if "/" in tracking_number:
-        pkg_numbers_to_try = tracking_number.split('/')
-    
-    soup = None
-    pkg_number = None
-    
-    for attempt in pkg_numbers_to_try:
-        url = base_url + attempt
-        try:
-            logger.info(f"Fetching URL: {url}")
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36'
-            }
-            response = requests.get(url, headers=headers, timeout=5)
-            logger.info(f"Response status: {response.status_code}, length: {len(response.text)}")
-            response.raise_for_status()
-            
-            temp_soup = BeautifulSoup(response.text, "html.parser")
-            if temp_soup.find("table", {"id": "200"}):
-                soup = temp_soup
-                pkg_number = attempt
-                break
-        except requests.RequestException as e:
-            logger.error(f"Error fetching {attempt}: {e}")
-            continue
-    
-    if not soup:
+    engine = FetchEngine(max_workers=1)
+    pkg_number, updates, attempts = _fetch_package(engine, tracking_number, timeout=5, use_cache=use_cache)
+
+    if updates is None:
+        if _fetch_error(updates, attempts):
+            # Every request failed: report it instead of "no updates"
+            raise attempts[-1][1]
         return None
-    
-    table = soup.find("table", {"id": "200"})
-    updates = []
-    rows = table.find_all("tr")[2:]  # skip header rows
-    
-    for row in rows:
-        cols = row.find_all("td")
-        if len(cols) < 4:
-            continue
-        date = cols[0].get_text(strip=True)
-        pays = cols[1].get_text(strip=True)
-        lieu = cols[2].get_text(strip=True)
-        event = cols[3].get_text(strip=True)
-        
-        updates.append({
-            "Date": date,
-            "Pays": pays,
-            "Lieu": lieu,
-            "Type d'événement": event
-        })
-    
-    # Determine location and status
-    location = ""
-    last_update_date = updates[-1]["Date"] if updates else None
-    is_today = False
-    if last_update_date:
-        try:
-            is_today = datetime.now().strftime("%d/%m/%Y") == datetime.strptime(last_update_date, "%d/%m/%Y %H:%M:%S").strftime("%d/%m/%Y")
-        except:
-            pass
-    
-    delivered = any("Livré" in u["Type d'événement"] for u in updates)
-    
-    if any("ghazala" in u["Lieu"].lower() for u in updates):
-        location = "Ghazala"
-    elif any("ariana" in u["Lieu"].lower() for u in updates):
-        location = "Ariana"
-    elif any("tunis" in u["Lieu"].lower() for u in updates):
-        location = "Tunis"
-    else:
-        location = "on the way"
-    
-    return {
-        "package_number": pkg_number,
-        "orders": package_orders,
-        "updates": updates,
-        "location": location,
-        "delivered": delivered,
-        "is_today": is_today,
-        "last_update_date": last_update_date
-    }
+
+    status = PackageStatus.from_fetch(None, pkg_number, package_orders, updates)
+    return status.to_dict()
 
 
 def load_packages_from_file(path="package_list.json"):
@@ -485,5 +887,14 @@ def load_packages_from_file(path="package_list.json"):
 
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Check every package of package_list.json")
+    parser.add_argument("--jsonl", action="store_true",
+                        help="stream the results to packages_updates.jsonl, one line per package")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary, not every package")
+    args = parser.parse_args()
     packages_list = load_packages_from_file()
-    fetch_package_updates(packages_list, show_only_updates=True)
+    output_file = "packages_updates.jsonl" if args.jsonl else "packages_updates.json"
+    fetch_package_updates(packages_list, output_file, show_only_updates=True, stream=args.jsonl, quiet=args.quiet)
+    if os.environ.get("TRACKER_METRICS_FILE"):
+        metrics.write_prometheus(os.environ["TRACKER_METRICS_FILE"])
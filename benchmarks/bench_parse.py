@@ -0,0 +1,67 @@
+"""Micro-benchmark: events table parsing on saved Item_Events.asp pages.
+
+Compares the old approach (full BeautifulSoup tree, then find/find_all and
+get_text on every cell) with ``tracking_parser.parse_tracking_page`` and
+checks that both return the same events.
+
+    python benchmarks/bench_parse.py [--repeat N]
+"""
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bs4 import BeautifulSoup
+
+from tracking_parser import parse_tracking_page
+
+PAGES_DIR = Path(__file__).resolve().parent / "pages"
+
+
+def parse_with_soup(html):
+    """The parsing code AliExpress.py used before tracking_parser"""
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("table", {"id": "200"})
+    if not table:
+        return None
+    updates = []
+    for row in table.find_all("tr")[2:]:
+        cols = row.find_all("td")
+        if len(cols) < 4:
+            continue
+        updates.append({
+            "Date": cols[0].get_text(strip=True),
+            "Pays": cols[1].get_text(strip=True),
+            "Lieu": cols[2].get_text(strip=True),
+            "Type d'événement": cols[3].get_text(strip=True)
+        })
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200, help="parses per page and parser")
+    args = parser.parse_args()
+
+    print(f"{'page':<24}{'events':>8}{'soup ms':>10}{'new ms':>10}{'speedup':>10}")
+    total_soup = total_new = 0.0
+    for path in sorted(PAGES_DIR.glob("*.html")):
+        html = path.read_text(encoding="utf-8")
+        expected = parse_with_soup(html)
+        if parse_tracking_page(html) != expected:
+            sys.exit(f"{path.name}: parsers disagree")
+
+        soup_s = timeit.timeit(lambda: parse_with_soup(html), number=args.repeat) / args.repeat
+        new_s = timeit.timeit(lambda: parse_tracking_page(html), number=args.repeat) / args.repeat
+        total_soup += soup_s
+        total_new += new_s
+        events = len(expected) if expected is not None else "-"
+        print(f"{path.name:<24}{events:>8}{soup_s * 1000:>10.3f}{new_s * 1000:>10.3f}{soup_s / new_s:>9.1f}x")
+
+    print(f"{'total':<24}{'':>8}{total_soup * 1000:>10.3f}{total_new * 1000:>10.3f}{total_soup / total_new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Benchmark: full scans against a local rapidposte stand-in server.
+
+Starts ``stand_in_server.StandInServer`` on a free port, points
+``AliExpress.BASE_URL`` at it and drives ``create_mobile_output``,
+``fetch_package_updates`` (also as ``desktop-stream``: JSON Lines output in
+quiet mode) and ``fetch_single_package`` on generated package
+lists. For every function and list size it reports packages per second,
+p50/p99 latency of one package fetch and the peak Python memory of the run.
+tracemalloc slows the scan down a lot, so memory is measured in a second,
+untimed run of the same workload (skip it with ``--no-memory``).
+
+The response cache and the event store are disabled so every run does the
+same network work, and the client rate limit is off unless ``--rate-limit``
+is given.
+
+    python benchmarks/bench_scan.py [--sizes 10,100,1000,10000] [--latency 0.05]
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stand_in_server import StandInServer
+
+FUNCTIONS = ("mobile", "desktop", "desktop-stream", "single")
+
+
+def build_packages(size, no_events=0.2, errors=0.02, split=0.1, seed=0):
+    """Return a package list mixing numbers with events, without and failing ones"""
+    rng = random.Random(seed)
+    packages = []
+    for i in range(size):
+        roll = rng.random()
+        if roll < errors:
+            number = f"ER{i:07d}TN"
+        elif roll < errors + no_events:
+            number = f"NO{i:07d}TN"
+        elif roll < errors + no_events + split:
+            number = f"NO{i:07d}TN/EV{i:07d}TN"
+        else:
+            number = f"EV{i:07d}TN"
+        packages.append({"package_number": number, "package orders": [f"Benchmark order {i}"]})
+    return packages
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (0 for an empty list)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def timed_fetches(tracker):
+    """Wrap ``tracker._fetch_package`` to record how long each package takes"""
+    latencies = []
+    fetch_package = tracker._fetch_package
+
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fetch_package(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    tracker._fetch_package = timed
+    return latencies
+
+
+def run_function(tracker, name, packages, args, workdir):
+    if name == "mobile":
+        tracker.create_mobile_output(packages, max_workers=args.workers,
+                                     per_host_limit=args.per_host_limit, use_cache=False)
+    elif name == "desktop":
+        with contextlib.chdir(workdir), contextlib.redirect_stdout(io.StringIO()):
+            tracker.fetch_package_updates(packages, output_file="packages_updates.json",
+                                          max_workers=args.workers,
+                                          per_host_limit=args.per_host_limit, use_cache=False)
+    elif name == "desktop-stream":
+        # JSON Lines output without the per-package console dump
+        with contextlib.chdir(workdir), contextlib.redirect_stdout(io.StringIO()):
+            tracker.fetch_package_updates(packages, output_file="packages_updates.jsonl",
+                                          max_workers=args.workers,
+                                          per_host_limit=args.per_host_limit, use_cache=False,
+                                          stream=True, quiet=True)
+    else:
+        for pkg in packages:
+            try:
+                tracker.fetch_single_package(pkg["package_number"], pkg["package orders"], use_cache=False)
+            except tracker.requests.RequestException:
+                pass
+
+
+def peak_memory(tracker, name, packages, args, workdir):
+    """Peak bytes allocated by Python while running ``name`` once"""
+    tracker.circuit_breaker.record_success()
+    tracemalloc.start()
+    try:
+        run_function(tracker, name, packages, args, workdir)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench(tracker, latencies, name, packages, args, workdir):
+    tracker.circuit_breaker.record_success()
+    latencies.clear()
+    started = time.perf_counter()
+    run_function(tracker, name, packages, args, workdir)
+    seconds = time.perf_counter() - started
+    peak = peak_memory(tracker, name, packages, args, workdir) if args.memory else 0
+    return {
+        "function": name,
+        "packages": len(packages),
+        "seconds": round(seconds, 3),
+        "packages_per_second": round(len(packages) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "peak_mib": round(peak / 2**20, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000", help="comma-separated package list sizes")
+    parser.add_argument("--functions", default=",".join(FUNCTIONS), help=f"any of {', '.join(FUNCTIONS)}")
+    parser.add_argument("--single-limit", type=int, default=100,
+                        help="fetch_single_package is called one package at a time, on at most this many")
+    parser.add_argument("--latency", type=float, default=0.05, help="server latency per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="random extra latency, up to this many seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--no-events", type=float, default=0.2, help="share of packages without events")
+    parser.add_argument("--errors", type=float, default=0.02, help="share of packages whose page always fails")
+    parser.add_argument("--split", type=float, default=0.1, help="share of \"A/B\" packages")
+    parser.add_argument("--workers", type=int, default=8, help="max_workers for the scan functions")
+    parser.add_argument("--per-host-limit", type=int, default=4, help="per_host_limit for the scan functions")
+    parser.add_argument("--rate-limit", default="0", help="TRACKER_RATE_LIMIT for the run (default: off)")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip the extra run that measures peak memory")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    os.environ["TRACKER_EVENT_DB"] = ""
+    os.environ["TRACKER_RATE_LIMIT"] = args.rate_limit
+    os.environ.pop("TRACKER_CACHE_FILE", None)
+    logging.disable(logging.CRITICAL)
+    import AliExpress as tracker
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    functions = [f.strip() for f in args.functions.split(",")]
+    results = []
+    with StandInServer(latency=args.latency, jitter=args.jitter,
+                       failure_rate=args.failure_rate, seed=0) as server, \
+            tempfile.TemporaryDirectory() as workdir:
+        tracker.BASE_URL = server.base_url
+        latencies = timed_fetches(tracker)
+        print(f"{'function':<16}{'packages':>10}{'seconds':>10}{'pkg/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MiB':>10}")
+        for size in sizes:
+            packages = build_packages(size, args.no_events, args.errors, args.split)
+            for name in functions:
+                run_packages = packages[:args.single_limit] if name == "single" else packages
+                result = bench(tracker, latencies, name, run_packages, args, workdir)
+                results.append(result)
+                print(f"{name:<16}{result['packages']:>10}{result['seconds']:>10.2f}"
+                      f"{result['packages_per_second']:>10.1f}{result['p50_ms']:>10.1f}"
+                      f"{result['p99_ms']:>10.1f}{result['peak_mib']:>10.2f}")
+        tracker.close_session()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Benchmark: bot import time and time to the first /checkall answer.
+
+Each measurement runs in a fresh interpreter, the way a redeploy starts:
+
+- ``import``: seconds to ``import telegram_bot``, plus the modules that take
+  longest to import (from ``python -X importtime``).
+- ``cold``: from process launch to the first report reply without a scan
+  snapshot, so ``/checkall`` has to scan first.
+- ``warm``: the same with the snapshot the cold run saved, so the report
+  comes from the restored scan while the refresh runs in the background.
+
+The scans go to a local stand-in server, the report is sent to a stand-in
+message object and the Bot API is never called.
+
+    python benchmarks/bench_startup.py [--packages 200] [--latency 0.05] [--runs 3]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from bench_scan import build_packages
+from stand_in_server import StandInServer
+
+# Child process: start like the bot does, answer one /checkall and print the
+# time the reply was sent
+CHILD = """
+import asyncio, time
+import telegram_bot
+
+class Chat:
+    id = 1
+
+class Message:
+    chat = Chat()
+    message_id = 1
+    text = ""
+    reply_markup = None
+
+    async def reply_text(self, text, **kwargs):
+        if text.startswith("\\U0001f550"):  # the report header
+            print(time.time(), flush=True)
+        return Message()
+
+    async def edit_text(self, text, **kwargs):
+        return self
+
+    def get_bot(self):
+        return None
+
+async def main():
+    telegram_bot.get_session()
+    if telegram_bot.restore_snapshot():
+        refresh = asyncio.create_task(telegram_bot.scan_all_packages(None))
+    else:
+        refresh = None
+    await telegram_bot.send_checkall_report(Message())
+    if refresh:
+        await refresh
+
+asyncio.run(main())
+"""
+
+
+def child_env(workdir, base_url, snapshot):
+    env = dict(os.environ)
+    env.update(
+        TELEGRAM_BOT_TOKEN="0:benchmark",
+        RAPIDPOSTE_BASE_URL=base_url,
+        TRACKER_SNAPSHOT_FILE=snapshot,
+        TRACKER_EVENT_DB="",
+        TRACKER_RATE_LIMIT="0",
+        POLL_INTERVAL="0",
+        PYTHONPATH=str(ROOT)
+    )
+    env.pop("TRACKER_CACHE_FILE", None)
+    return env
+
+
+def import_seconds(env, workdir):
+    code = "import time; t = time.perf_counter(); import telegram_bot; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], env=env, cwd=workdir,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.split()[-1])
+
+
+def slowest_imports(env, workdir, top=8):
+    """Top-level modules of ``import telegram_bot`` by cumulative import time"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import telegram_bot"], env=env,
+                         cwd=workdir, capture_output=True, text=True, check=True)
+    modules = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit() and name.startswith("   ") and not name.startswith("    "):
+            modules.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def first_response_seconds(env, workdir):
+    started = time.time()
+    out = subprocess.run([sys.executable, "-c", CHILD], env=env, cwd=workdir,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.split()[0]) - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--packages", type=int, default=200, help="size of the package list")
+    parser.add_argument("--latency", type=float, default=0.05, help="server latency per request in seconds")
+    parser.add_argument("--runs", type=int, default=3, help="runs per measurement (the median is shown)")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    with StandInServer(latency=args.latency, seed=0) as server, tempfile.TemporaryDirectory() as workdir:
+        with open(Path(workdir) / "package_list.json", "w", encoding="utf-8") as f:
+            json.dump(build_packages(args.packages), f)
+        snapshot = str(Path(workdir) / "scan_snapshot.json")
+        env = child_env(workdir, server.base_url, snapshot)
+
+        results["import_s"] = statistics.median(import_seconds(env, workdir) for _ in range(args.runs))
+        print(f"import telegram_bot: {results['import_s']:.3f}s")
+        for seconds, name in slowest_imports(env, workdir):
+            print(f"  {name:<24}{seconds:.3f}s")
+
+        cold = []
+        for _ in range(args.runs):
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+            cold.append(first_response_seconds(env, workdir))
+        warm = [first_response_seconds(env, workdir) for _ in range(args.runs)]
+        results["cold_first_response_s"] = statistics.median(cold)
+        results["warm_first_response_s"] = statistics.median(warm)
+        print(f"first /checkall answer, {args.packages} packages: "
+              f"cold {results['cold_first_response_s']:.2f}s, warm {results['warm_first_response_s']:.2f}s")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Replay recorded Telegram updates against the bot's webhook.
+
+Posts the update payloads of a JSONL file (one Telegram ``Update`` object
+per line, e.g. ``updates/sample.jsonl``) to a bot started in webhook mode,
+the way Telegram would, and reports the HTTP status codes and the p50/p99
+time the webhook took to accept them. ``--chats`` spreads the updates over
+that many chat ids to check that several chats are handled in parallel;
+every post gets a fresh ``update_id``.
+
+    TELEGRAM_WEBHOOK_PORT=8443 python telegram_bot.py
+    python benchmarks/replay_updates.py [--url http://127.0.0.1:8443/telegram] [--repeat 10] [--chats 5]
+
+With only TELEGRAM_WEBHOOK_PORT set the bot serves the webhook locally
+without registering it with Telegram, so no tunnel is needed. It still
+answers through the real Bot API, so use a test bot token and, for
+``--chats``, chat ids it is allowed to write to.
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from bench_scan import percentile
+
+DEFAULT_FILE = Path(__file__).resolve().parent / "updates" / "sample.jsonl"
+
+
+def load_updates(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def with_chat(update, chat_id):
+    """Copy of ``update`` sent from ``chat_id`` instead of its recorded chat"""
+    update = copy.deepcopy(update)
+    for key in ("message", "edited_message", "callback_query"):
+        item = update.get(key)
+        if not item:
+            continue
+        message = item.get("message", item)
+        message["chat"]["id"] = chat_id
+        if "from" in item:
+            item["from"]["id"] = chat_id
+    return update
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram", help="webhook listen address and path")
+    parser.add_argument("--file", default=str(DEFAULT_FILE), help="JSONL file of recorded updates")
+    parser.add_argument("--secret", default=os.environ.get("TELEGRAM_WEBHOOK_SECRET"),
+                        help="secret token of the webhook (default: TELEGRAM_WEBHOOK_SECRET)")
+    parser.add_argument("--repeat", type=int, default=1, help="how many times the file is replayed")
+    parser.add_argument("--chats", type=int, default=0, help="rewrite the chat ids to this many chats (default: as recorded)")
+    parser.add_argument("--first-chat", type=int, default=100000001, help="first chat id used by --chats")
+    parser.add_argument("--concurrency", type=int, default=8, help="posts in flight at the same time")
+    args = parser.parse_args()
+
+    recorded = load_updates(args.file)
+    updates = []
+    update_ids = itertools.count(int(time.time()))
+    for i, update in enumerate(recorded * args.repeat):
+        if args.chats:
+            update = with_chat(update, args.first_chat + i % args.chats)
+        updates.append(dict(update, update_id=next(update_ids)))
+
+    headers = {"Content-Type": "application/json"}
+    if args.secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = args.secret
+    session = requests.Session()
+
+    def post(update):
+        started = time.perf_counter()
+        try:
+            status = session.post(args.url, data=json.dumps(update), headers=headers, timeout=10).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(post, updates))
+    seconds = time.perf_counter() - started
+
+    statuses = Counter(status for status, _ in results)
+    latencies = [latency for _, latency in results]
+    print(f"{len(updates)} updates in {seconds:.2f}s ({len(updates) / seconds:.1f}/s)")
+    print("status: " + ", ".join(f"{status} x{n}" for status, n in sorted(statuses.items(), key=str)))
+    print(f"accept p50 {percentile(latencies, 50) * 1000:.1f} ms, p99 {percentile(latencies, 99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Local stand-in for rapidposte's ``Item_Events.asp`` used by the benchmarks.
+
+The page served for an ``ItemId`` depends on its prefix:
+
+- ``EV...`` - a saved page with events (cycles through the ``events_*.html``
+  pages in ``benchmarks/pages/``)
+- ``NO...`` - the saved page without an events table
+- ``ER...`` - always answers ``503 Service Unavailable``
+
+Any request can also be delayed (``latency`` plus up to ``jitter`` seconds)
+and fail at random with a 503 (``failure_rate``).
+
+    python benchmarks/stand_in_server.py [--port 8080] [--latency 0.05]
+
+then run the bot or ``AliExpress.py`` with
+``RAPIDPOSTE_BASE_URL=http://127.0.0.1:8080/fr/Item_Events.asp?ItemId=``.
+"""
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+PAGES_DIR = Path(__file__).resolve().parent / "pages"
+ITEM_PATH = "/fr/Item_Events.asp"
+
+
+class StandInServer:
+    """Threaded HTTP server answering like ``Item_Events.asp`` from saved pages"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 pages_dir=PAGES_DIR, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._event_pages = [p.read_bytes() for p in sorted(Path(pages_dir).glob("events_*.html"))]
+        self._empty_page = (Path(pages_dir) / "no_events.html").read_bytes()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}{ITEM_PATH}?ItemId="
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve in the calling thread until interrupted"""
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _delay_and_fail(self):
+        """Return the delay for one request and whether it should fail"""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            return delay, self._random.random() < self.failure_rate
+
+    def page_for(self, item_id):
+        """Return the body served for ``item_id``, or None for an error"""
+        if item_id.startswith("ER"):
+            return None
+        if item_id.startswith("EV") and self._event_pages:
+            digits = "".join(c for c in item_id if c.isdigit())
+            return self._event_pages[int(digits or 0) % len(self._event_pages)]
+        return self._empty_page
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                item_id = parse_qs(url.query).get("ItemId", [""])[0]
+                delay, fail = server._delay_and_fail()
+                if delay:
+                    time.sleep(delay)
+                body = server.page_for(item_id) if url.path == ITEM_PATH else None
+                if fail or body is None:
+                    self.send_response(503)
+                    body = b"Service Unavailable"
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency, up to this many seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    args = parser.parse_args()
+
+    server = StandInServer(args.host, args.port, args.latency, args.jitter, args.failure_rate)
+    print(f"Serving on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
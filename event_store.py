@@ -0,0 +1,144 @@
+import sqlite3
+import threading
+import time
+
+
+class EventStore:
+    """SQLite store of every tracking event seen so far.
+
+    Events are keyed by (tracking number, date, lieu, event), so recording a
+    scan only inserts rows that were not seen before. Each scan gets an id and
+    the rows it added are its delta, which lets formatters and notifications
+    work on what changed instead of the full history.
+    """
+
+    def __init__(self, path="package_events.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS scans (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS events (
+                    tracking_number TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    lieu TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    pays TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    scan_id INTEGER NOT NULL REFERENCES scans(id),
+                    PRIMARY KEY (tracking_number, date, lieu, event)
+                );
+                CREATE INDEX IF NOT EXISTS events_by_scan ON events (scan_id);
+                CREATE TABLE IF NOT EXISTS alternates (
+                    package_number TEXT PRIMARY KEY,
+                    tracking_number TEXT NOT NULL
+                );
+            """)
+
+    def record_scan(self, histories):
+        """Store the events of a scan and return the per-package delta.
+
+        ``histories`` maps each package number to its list of update dicts.
+        Returns ``{package_number: [new updates]}`` for packages that gained
+        at least one event.
+        """
+        delta = {}
+        with self._lock, self._conn:
+            scan_id = self._conn.execute(
+                "INSERT INTO scans (started_at) VALUES (?)", (time.time(),)
+            ).lastrowid
+            for tracking_number, updates in histories.items():
+                new = self._insert_new(scan_id, tracking_number, updates)
+                if new:
+                    delta[tracking_number] = new
+        return delta
+
+    def start_scan(self):
+        """Open a scan whose packages are recorded one at a time with ``record_package``"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "INSERT INTO scans (started_at) VALUES (?)", (time.time(),)
+            ).lastrowid
+
+    def record_package(self, scan_id, tracking_number, updates):
+        """Store one package's events in scan ``scan_id`` and return its new updates"""
+        with self._lock, self._conn:
+            return self._insert_new(scan_id, tracking_number, updates)
+
+    def _insert_new(self, scan_id, tracking_number, updates):
+        known = set(self._conn.execute(
+            "SELECT date, lieu, event FROM events WHERE tracking_number = ?", (tracking_number,)
+        ))
+        new = []
+        rows = []
+        for position, u in enumerate(updates):
+            key = (u["Date"], u["Lieu"], u["Type d'événement"])
+            if key in known:
+                continue
+            known.add(key)
+            new.append(u)
+            rows.append((tracking_number, *key, u["Pays"], position, scan_id))
+        self._conn.executemany(
+            "INSERT INTO events (tracking_number, date, lieu, event, pays, position, scan_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        return new
+
+    def last_delta(self):
+        """Return the delta recorded by the most recent scan"""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(id) FROM scans").fetchone()
+            if row[0] is None:
+                return {}
+            cursor = self._conn.execute(
+                "SELECT tracking_number, date, pays, lieu, event FROM events "
+                "WHERE scan_id = ? ORDER BY tracking_number, position",
+                (row[0],)
+            )
+            delta = {}
+            for tracking_number, date, pays, lieu, event in cursor:
+                delta.setdefault(tracking_number, []).append(_as_update(date, pays, lieu, event))
+            return delta
+
+    def history(self, tracking_number):
+        """Return every stored event of a package, oldest first"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT date, pays, lieu, event FROM events "
+                "WHERE tracking_number = ? ORDER BY scan_id, position",
+                (tracking_number,)
+            )
+            return [_as_update(*row) for row in cursor]
+
+    def preferred_alternate(self, package_number):
+        """Return the number of an "A/B" entry that last had events, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tracking_number FROM alternates WHERE package_number = ?", (package_number,)
+            ).fetchone()
+            return row[0] if row else None
+
+    def set_preferred_alternate(self, package_number, tracking_number):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO alternates (package_number, tracking_number) VALUES (?, ?)",
+                (package_number, tracking_number)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _as_update(date, pays, lieu, event):
+    return {
+        "Date": date,
+        "Pays": pays,
+        "Lieu": lieu,
+        "Type d'événement": event
+    }
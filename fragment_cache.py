@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """Rendered text of each package, reused while the package is unchanged.
+
+    Fragments are stored per ``(kind, key)``, where the key identifies the
+    package (its number and orders), together with the fingerprint of the
+    state they were rendered from (latest event, today flag...). A lookup
+    with the same fingerprint returns the stored lines; a different one
+    renders again and replaces them, so there is one fragment per package
+    and kind. The least recently used fragments are dropped beyond
+    ``max_entries``.
+
+    Returned lists are shared between reports and must not be modified.
+    """
+
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(self, kind, key, fingerprint, render):
+        """Return the lines for ``key``, calling ``render()`` only if its fingerprint changed"""
+        key = (kind, key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        lines = render()
+        with self._lock:
+            self._entries[key] = (fingerprint, lines)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# Shared by the mobile report, the single package detail and the desktop log
+fragments = FragmentCache()
@@ -0,0 +1,128 @@
+import os
+import re
+from dataclasses import dataclass
+
+ON_THE_WAY = "on the way"
+
+# Tunisian offices in priority order: when a history mentions several, the
+# first one listed is the package's location. Each office is matched by any
+# of its patterns, case-insensitively, anywhere in the event's "Lieu".
+DEFAULT_OFFICES = (
+    ("Ghazala", ("ghazala",)),
+    ("Ariana", ("ariana",)),
+    ("Tunis", ("tunis",)),
+)
+DELIVERED_MARKERS = ("Livré",)
+MEMO_SIZE = 10000  # distinct "Lieu"/event texts remembered (there are few offices)
+_UNKNOWN = object()
+
+
+@dataclass(frozen=True, slots=True)
+class Classification:
+    location: str  # highest-priority office seen, or ON_THE_WAY
+    delivered: bool
+    latest_office: str | None  # office of the most recent event at one, if any
+
+
+class LocationClassifier:
+    """Classify a tracking history in a single pass over its events.
+
+    All office patterns are compiled into one alternation, so each "Lieu" is
+    searched once whatever the number of offices. The alternation is a
+    lookahead tried at every position, so matches may overlap and a pattern
+    found earlier in the text cannot hide a higher-priority one (e.g.
+    "cite ghazala" and "ghazala"). The delivered markers are matched in the
+    same loop. The same few "Lieu" and event texts come back in every
+    history, so their results are memoized and most events cost two dict
+    lookups.
+    """
+
+    def __init__(self, offices=DEFAULT_OFFICES, delivered_markers=DELIVERED_MARKERS):
+        self.office_names = tuple(name for name, _ in offices)
+        self._office_by_group = {}
+        groups = []
+        for priority, (name, patterns) in enumerate(offices):
+            for pattern in patterns:
+                groups.append(f"({re.escape(pattern)})")
+                self._office_by_group[len(groups)] = (priority, name)
+        self._offices = re.compile(f"(?=(?:{'|'.join(groups)}))", re.IGNORECASE) if groups else None
+        self._delivered = re.compile("|".join(re.escape(m) for m in delivered_markers))
+        self._lieu_memo = {}
+        self._event_memo = {}
+
+    @classmethod
+    def from_env(cls):
+        """Build the classifier from ``TRACKER_OFFICES`` if set, else the default table"""
+        spec = os.environ.get("TRACKER_OFFICES")
+        return cls(parse_offices(spec)) if spec else cls()
+
+    def offices_in(self, lieu):
+        """Return ``(priority, name)`` of the best office mentioned in ``lieu``, or None"""
+        office = self._lieu_memo.get(lieu, _UNKNOWN)
+        if office is not _UNKNOWN:
+            return office
+        office = None
+        if self._offices is not None:
+            office = min((self._office_by_group[m.lastindex] for m in self._offices.finditer(lieu)), default=None)
+        _remember(self._lieu_memo, lieu, office)
+        return office
+
+    def is_delivered(self, event):
+        delivered = self._event_memo.get(event, _UNKNOWN)
+        if delivered is not _UNKNOWN:
+            return delivered
+        delivered = self._delivered.search(event) is not None
+        _remember(self._event_memo, event, delivered)
+        return delivered
+
+    def classify(self, events):
+        """Classify ``events`` (oldest first), each with ``lieu`` and ``event`` attributes"""
+        best = None
+        latest = None
+        delivered = False
+        lieu_memo = self._lieu_memo
+        event_memo = self._event_memo
+        for e in events:
+            office = lieu_memo.get(e.lieu, _UNKNOWN)
+            if office is _UNKNOWN:
+                office = self.offices_in(e.lieu)
+            if office is not None:
+                latest = office
+                if best is None or office < best:
+                    best = office
+            if not delivered:
+                delivered = event_memo.get(e.event, _UNKNOWN)
+                if delivered is _UNKNOWN:
+                    delivered = self.is_delivered(e.event)
+        return Classification(
+            best[1] if best else ON_THE_WAY,
+            delivered,
+            latest[1] if latest else None
+        )
+
+
+def _remember(memo, key, value):
+    if len(memo) >= MEMO_SIZE:
+        memo.clear()
+    memo[key] = value
+
+
+def parse_offices(spec):
+    """Parse an office table like ``"Ghazala;Ariana=ariana|ariana ctr;Tunis"``.
+
+    Offices are separated by ";" in priority order. An office without
+    "=patterns" is matched by its own name.
+    """
+    offices = []
+    for entry in spec.split(";"):
+        name, _, patterns = entry.partition("=")
+        name = name.strip()
+        if not name:
+            continue
+        patterns = tuple(p.strip() for p in patterns.split("|") if p.strip()) or (name,)
+        offices.append((name, patterns))
+    return tuple(offices)
+
+
+# Shared classifier used by the scraper, the planner and the bot
+classifier = LocationClassifier.from_env()
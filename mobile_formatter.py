@@ -1,122 +1,191 @@
+from dataclasses import dataclass
 from datetime import datetime
 
+from fragment_cache import fragments
+from metrics import metrics
 
-def format_mobile_output(results, packages_in_tunisia_not_delivered, packages_on_the_way, 
-                         total_packages, found_updates, no_update):
-    """Create mobile-friendly output with updated summary format"""
-    
-    mobile_output = []
-    
-    # Header
-    mobile_output.append("📦 PACKAGE TRACKER")
-    mobile_output.append("━━━━━━━━━━━━━━━")
-    mobile_output.append("")
-    
-    # Calculate summary statistics
+SEPARATOR = "━━━━━━━━━━━━━━━"
+PAGE_CHARS = 3500  # keep pages well under Telegram's 4096-character limit
+
+
+@dataclass(slots=True)
+class ReportSection:
+    """One group of packages in the mobile report.
+
+    ``blocks`` holds the lines of each package without the closing
+    "├─"/"└─" line, so a section can be rendered whole or cut into pages.
+    ``numbers`` are the tracking numbers of the blocks, in the same order,
+    when the section offers a detail button per package (else empty).
+    """
+    key: str
+    label: str
+    heading: str
+    blocks: list
+    numbers: list
+
+
+def _short(order):
+    """Truncate an order description for mobile"""
+    return order[:27] + "..." if len(order) > 30 else order
+
+
+def _update_block(p):
+    """Lines of a package with updates, re-rendered only when its state changed"""
+    return fragments.render(
+        "mobile", (p['package_number'], tuple(p['orders'])),
+        (p['last_update_date'], p['is_today'], p.get('new_updates')),
+        lambda: _render_update_block(p)
+    )
+
+
+def _render_update_block(p):
+    lines = [f"┌─ {p['package_number']}"]
+    # First order, then additional orders if any
+    for o in p['orders']:
+        lines.append(f" │  📝 {_short(o)}")
+    lines.append(f" │  🕐 {p['last_update_date']}")
+
+    # Status indicators
+    status_indicators = []
+    if p['is_today']:
+        status_indicators.append("✨ Today")
+    if p.get('new_updates'):
+        status_indicators.append(f"🆕 {p['new_updates']} new")
+    if status_indicators:
+        lines.append(f" │  {' '.join(status_indicators)}")
+    return lines
+
+
+def _status_block(res, status):
+    """Lines of a package without updates: number, first order and ``status``"""
+    return fragments.render(
+        "mobile_status", (res['package_number'], res['orders'][0]), status,
+        lambda: [f"┌─ {res['package_number']}", f" │  📝 {_short(res['orders'][0])}", f" │  {status}"]
+    )
+
+
+def _closed(blocks):
+    """Join package blocks, closing each with "├─" and the last one with "└─"."""
+    lines = []
+    for i, block in enumerate(blocks):
+        lines.extend(block)
+        lines.append("└─" if i == len(blocks) - 1 else "├─")
+    return lines
+
+
+def report_sections(packages_in_tunisia_not_delivered, packages_on_the_way, no_update, fetch_errors=()):
+    """Return the report's package groups as ``ReportSection``s, in display order"""
+    sections = []
+    for loc, pkgs in packages_in_tunisia_not_delivered.items():
+        if pkgs:
+            sections.append(ReportSection(
+                f"tunisia:{loc}", f"📍 {loc}", f"🏢 {loc} ({len(pkgs)})",
+                [_update_block(p) for p in pkgs], [p['package_number'] for p in pkgs]
+            ))
+    if packages_on_the_way:
+        sections.append(ReportSection(
+            "on_the_way", "🚚 On the way", f"🚚 ON THE WAY ({len(packages_on_the_way)})",
+            [_update_block(p) for p in packages_on_the_way], [p['package_number'] for p in packages_on_the_way]
+        ))
+    if no_update:
+        sections.append(ReportSection(
+            "no_update", "❌ No updates", "❌ NO UPDATES",
+            [_status_block(res, "❌ No updates found") for res in no_update], []
+        ))
+    # Packages whose page could not be fetched (site down or rate-limited)
+    if fetch_errors:
+        sections.append(ReportSection(
+            "errors", "⚠️ Errors", "⚠️ FETCH ERRORS",
+            [_status_block(res, "⚠️ Site not reachable, will retry") for res in fetch_errors], []
+        ))
+    return sections
+
+
+def format_summary(results, packages_in_tunisia_not_delivered, packages_on_the_way,
+                   total_packages, found_updates, fetch_errors=()):
+    """Header and summary lines of the mobile report"""
     delivered_count = sum(1 for res in results if res.get("delivered", False))
     non_delivered_count = found_updates - delivered_count
     in_tunisia_not_delivered = sum(len(pkgs) for pkgs in packages_in_tunisia_not_delivered.values())
-    on_the_way_count = len(packages_on_the_way)
-    
-    # Summary Section
-    mobile_output.append("📊 SUMMARY")
-    mobile_output.append(f"• Updates found: {found_updates}/{total_packages}")
-    mobile_output.append(f"• Delivered: {delivered_count}")
-    mobile_output.append(f"• Non-delivered (ND): {non_delivered_count}")
-    mobile_output.append(f"• In Tunisia (ND): {in_tunisia_not_delivered}")
-    mobile_output.append(f"• On the way: {on_the_way_count}")
-    mobile_output.append("")
-    
-    # Packages in Tunisia (not delivered)
-    if in_tunisia_not_delivered > 0:
-        mobile_output.append("📍 TUNISIA")
-        mobile_output.append("━━━━━━━━━━━━━━━")
-        mobile_output.append("")
-        
-        for loc, pkgs in packages_in_tunisia_not_delivered.items():
-            if pkgs:
-                mobile_output.append(f"🏢 {loc} ({len(pkgs)})")
-                for i, p in enumerate(pkgs):
-                    # Package number
-                    mobile_output.append(f"┌─ {p['package_number']}")
-                    
-                    # First order description (truncated for mobile)
-                    first_order = p['orders'][0]
-                    if len(first_order) > 30:
-                        first_order = first_order[:27] + "..."
-                    mobile_output.append(f" │  📝 {first_order}")
-                    
-                    # Additional orders if any
-                    if len(p['orders']) > 1:
-                        for o in p['orders'][1:]:
-                            if len(o) > 30:
-                                o = o[:27] + "..."
-                            mobile_output.append(f" │  📝 {o}")
-                    
-                    # Last update date
-                    mobile_output.append(f" │  🕐 {p['last_update_date']}")
-                    
-                    # Status indicators
-                    status_indicators = []
-                    if p['is_today']:
-                        status_indicators.append("✨ Today")
-                    
-                    if status_indicators:
-                        mobile_output.append(f" │  {' '.join(status_indicators)}")
-                    
-                    # Close the package block
-                    mobile_output.append("└─" if i == len(pkgs) - 1 else "├─")
-                mobile_output.append("")
-    
-    # Packages on the way
-    if packages_on_the_way:
-        mobile_output.append(f"🚚 ON THE WAY ({on_the_way_count})")
-        mobile_output.append("━━━━━━━━━━━━━━━")
-        mobile_output.append("")
-        
-        for i, p in enumerate(packages_on_the_way):
-            # Package number
-            mobile_output.append(f"┌─ {p['package_number']}")
-            
-            # First order description (truncated for mobile)
-            first_order = p['orders'][0]
-            if len(first_order) > 30:
-                first_order = first_order[:27] + "..."
-            mobile_output.append(f" │  📝 {first_order}")
-            
-            # Additional orders if any
-            if len(p['orders']) > 1:
-                for o in p['orders'][1:]:
-                    if len(o) > 30:
-                        o = o[:27] + "..."
-                    mobile_output.append(f" │  📝 {o}")
-            
-            # Last update date
-            mobile_output.append(f" │  🕐 {p['last_update_date']}")
-            
-            # Status indicators
-            if p['is_today']:
-                mobile_output.append(" │  ✨ Today")
-            
-            # Close the package block
-            mobile_output.append("└─" if i == len(packages_on_the_way) - 1 else "├─")
-        mobile_output.append("")
-    
-    # No updates
-    if no_update:
-        mobile_output.append("❌ NO UPDATES")
-        mobile_output.append("━━━━━━━━━━━━━━━")
-        mobile_output.append("")
-        
-        for i, res in enumerate(no_update):
-            first_order = res['orders'][0]
-            if len(first_order) > 30:
-                first_order = first_order[:27] + "..."
-            mobile_output.append(f"┌─ {res['package_number']}")
-            mobile_output.append(f" │  📝 {first_order}")
-            mobile_output.append(" │  ❌ No updates found")
-            mobile_output.append("└─" if i == len(no_update) - 1 else "├─")
+
+    summary = ["📦 PACKAGE TRACKER", SEPARATOR, ""]
+    summary.append("📊 SUMMARY")
+    summary.append(f"• Updates found: {found_updates}/{total_packages}")
+    summary.append(f"• Delivered: {delivered_count}")
+    summary.append(f"• Non-delivered (ND): {non_delivered_count}")
+    summary.append(f"• In Tunisia (ND): {in_tunisia_not_delivered}")
+    summary.append(f"• On the way: {len(packages_on_the_way)}")
+    if fetch_errors:
+        summary.append(f"• Fetch errors: {len(fetch_errors)}")
+    summary.append("")
+    return summary
+
+
+def format_mobile_output(results, packages_in_tunisia_not_delivered, packages_on_the_way,
+                         total_packages, found_updates, no_update, fetch_errors=()):
+    """Create mobile-friendly output with updated summary format"""
+    return format_report(results, packages_in_tunisia_not_delivered, packages_on_the_way,
+                         total_packages, found_updates, no_update, fetch_errors)[2]
+
+
+@metrics.timed("stage_seconds", stage="format")
+def format_report(results, packages_in_tunisia_not_delivered, packages_on_the_way,
+                  total_packages, found_updates, no_update, fetch_errors=()):
+    """Return ``(summary, sections, mobile_output)`` of the mobile report.
+
+    Package blocks come from the fragment cache, so only packages whose
+    state changed since the last report are rendered again.
+    """
+    summary = format_summary(results, packages_in_tunisia_not_delivered, packages_on_the_way,
+                             total_packages, found_updates, fetch_errors)
+    sections = report_sections(packages_in_tunisia_not_delivered, packages_on_the_way, no_update, fetch_errors)
+
+    mobile_output = list(summary)
+    in_tunisia = False
+    for section in sections:
+        if section.key.startswith("tunisia:"):
+            # Offices share one "TUNISIA" heading
+            if not in_tunisia:
+                mobile_output.extend(["📍 TUNISIA", SEPARATOR, ""])
+                in_tunisia = True
+            mobile_output.append(section.heading)
+        else:
+            mobile_output.extend([section.heading, SEPARATOR, ""])
+        mobile_output.extend(_closed(section.blocks))
         mobile_output.append("")
 
-    return mobile_output
+    return summary, sections, mobile_output
+
+
+def paginate(sections, page_size=10, max_chars=PAGE_CHARS):
+    """Cut the sections into pages of at most ``page_size`` packages.
+
+    A page never mixes sections and never splits a package, and is also cut
+    early when its text would exceed ``max_chars``. Returns a list of
+    ``(section_index, start, end)`` block ranges; render one with
+    ``format_page``.
+    """
+    pages = []
+    for index, section in enumerate(sections):
+        start = 0
+        size = len(section.heading) + len(SEPARATOR) + 32
+        for i, block in enumerate(section.blocks):
+            block_size = sum(len(line) + 1 for line in block) + 3
+            if i > start and (i - start >= page_size or size + block_size > max_chars):
+                pages.append((index, start, i))
+                start = i
+                size = len(section.heading) + len(SEPARATOR) + 32
+            size += block_size
+        if section.blocks:
+            pages.append((index, start, len(section.blocks)))
+    return pages
+
 
+def format_page(sections, pages, page_number):
+    """Lines of page ``page_number`` (0-based) of ``paginate``'s pages"""
+    index, start, end = pages[page_number]
+    section = sections[index]
+    heading = section.heading
+    if start > 0 or end < len(section.blocks):
+        heading += f" · {start + 1}-{end}"
+    return [heading, SEPARATOR, ""] + _closed(section.blocks[start:end])
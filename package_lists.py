@@ -0,0 +1,121 @@
+import json
+import sqlite3
+import threading
+import time
+
+from package_registry import normalize, tracking_keys
+
+
+class PackageLists:
+    """SQLite store of each chat's own package list.
+
+    Entries have the same shape as ``package_list.json`` ("package_number"
+    and "package orders"). ``all_packages()`` merges every chat's list into
+    one list with each tracking number once, so a number followed by several
+    chats is fetched once per scan and its result fanned out to all of them.
+    Like ``PackageRegistry``, every number of an entry (both halves of an
+    "A/B" one) is indexed, so ``find`` does not scan the chat's list.
+    """
+
+    def __init__(self, path="package_lists.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS chat_packages (
+                    chat_id INTEGER NOT NULL,
+                    package_number TEXT NOT NULL,
+                    orders TEXT NOT NULL,
+                    added_at REAL NOT NULL,
+                    PRIMARY KEY (chat_id, package_number)
+                );
+                CREATE INDEX IF NOT EXISTS chat_packages_by_number ON chat_packages (package_number);
+                CREATE TABLE IF NOT EXISTS chat_package_keys (
+                    chat_id INTEGER NOT NULL,
+                    tracking_key TEXT NOT NULL,
+                    package_number TEXT NOT NULL,
+                    PRIMARY KEY (chat_id, tracking_key, package_number)
+                );
+            """)
+            # Index the entries of lists saved before the keys table existed
+            rows = self._conn.execute("SELECT chat_id, package_number FROM chat_packages").fetchall()
+            self._insert_keys(rows)
+
+    def add(self, chat_id, package_number, orders=()):
+        """Add a package to a chat's list (or replace its orders); True if it is new"""
+        with self._lock, self._conn:
+            existed = self._conn.execute(
+                "SELECT 1 FROM chat_packages WHERE chat_id = ? AND package_number = ?",
+                (chat_id, package_number)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT INTO chat_packages (chat_id, package_number, orders, added_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (chat_id, package_number) DO UPDATE SET orders = excluded.orders",
+                (chat_id, package_number, json.dumps(list(orders), ensure_ascii=False), time.time())
+            )
+            self._insert_keys([(chat_id, package_number)])
+            return existed is None
+
+    def remove(self, chat_id, package_number):
+        """Remove a package from a chat's list; True if it was there"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM chat_packages WHERE chat_id = ? AND package_number = ?",
+                (chat_id, package_number)
+            )
+            self._conn.execute(
+                "DELETE FROM chat_package_keys WHERE chat_id = ? AND package_number = ?",
+                (chat_id, package_number)
+            )
+            return cursor.rowcount > 0
+
+    def packages(self, chat_id):
+        """Return a chat's package list, oldest first"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT package_number, orders FROM chat_packages WHERE chat_id = ? ORDER BY added_at",
+                (chat_id,)
+            )
+            return [_as_package(number, orders) for number, orders in cursor]
+
+    def find(self, chat_id, tracking_number):
+        """Return the chat's entry for a tracking number (or one half of it), or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT p.package_number, p.orders FROM chat_package_keys k "
+                "JOIN chat_packages p ON p.chat_id = k.chat_id AND p.package_number = k.package_number "
+                "WHERE k.chat_id = ? AND k.tracking_key = ? ORDER BY p.added_at LIMIT 1",
+                (chat_id, normalize(tracking_number))
+            ).fetchone()
+            return _as_package(*row) if row else None
+
+    def all_packages(self):
+        """Return every listed package once, with the orders of the chat that added it first"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT package_number, orders FROM chat_packages ORDER BY added_at"
+            )
+            unique = {}
+            for number, orders in cursor:
+                unique.setdefault(number, _as_package(number, orders))
+            return list(unique.values())
+
+    def chats(self):
+        """Return the ids of the chats that have a list"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT chat_id FROM chat_packages")]
+
+    def _insert_keys(self, entries):
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO chat_package_keys (chat_id, tracking_key, package_number) VALUES (?, ?, ?)",
+            [(chat_id, key, number) for chat_id, number in entries for key in tracking_keys(number)]
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _as_package(package_number, orders):
+    return {"package_number": package_number, "package orders": json.loads(orders)}
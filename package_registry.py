@@ -0,0 +1,65 @@
+import json
+import os
+import threading
+
+
+class PackageRegistry:
+    """The package list file, parsed once and reloaded only when it changes.
+
+    Every tracking number is indexed, including both halves of split "A/B"
+    entries, so looking up a package is a dict access instead of a scan of
+    the whole list. A missing file is an empty list.
+    """
+
+    def __init__(self, path="package_list.json"):
+        self.path = path
+        self._stamp = None
+        self._packages = []
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def packages(self):
+        """Return the package list, re-reading the file if it was modified"""
+        with self._lock:
+            self._refresh()
+            return self._packages
+
+    def find(self, tracking_number):
+        """Return the package entry for a tracking number (or one half of it), or None"""
+        with self._lock:
+            self._refresh()
+            return self._index.get(normalize(tracking_number))
+
+    def orders_for(self, tracking_number):
+        pkg = self.find(tracking_number)
+        return pkg.get("package orders", []) if pkg else []
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # No file is an empty list, until one is created
+            self._packages, self._index, self._stamp = [], {}, None
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            packages = json.load(f)
+        index = {}
+        for pkg in packages:
+            for key in tracking_keys(pkg.get("package_number", "")):
+                index.setdefault(key, pkg)
+        self._packages, self._index, self._stamp = packages, index, stamp
+
+
+def normalize(tracking_number):
+    return tracking_number.strip().upper()
+
+
+def tracking_keys(package_number):
+    """Normalized numbers a package can be found by: the entry itself and each "A/B" half"""
+    keys = [normalize(package_number)]
+    if "/" in package_number:
+        keys += [normalize(half) for half in package_number.split("/")]
+    return [key for key in keys if key]
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from location_classifier import classifier
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+TUNISIA_OFFICES = classifier.office_names
+
+
+class PollingPlanner:
+    """Decide when each package should be fetched again.
+
+    The next check is derived from what the last fetch showed:
+
+    - delivered packages are never fetched again
+    - packages at a Tunisian office are checked every ``tunisia_interval``
+    - packages on the way are checked often while they move (updated today
+      or in the last few days) and rarely once their last event is old
+    - numbers with no events back off exponentially from
+      ``no_update_interval`` up to ``no_update_max``
+
+    Packages the planner has not seen yet are always due.
+    """
+
+    def __init__(self, tunisia_interval=15 * MINUTE, today_interval=30 * MINUTE,
+                 moving_interval=HOUR, slow_interval=3 * HOUR, stale_interval=12 * HOUR,
+                 moving_days=3, stale_days=14,
+                 no_update_interval=30 * MINUTE, no_update_max=24 * HOUR):
+        self.tunisia_interval = tunisia_interval
+        self.today_interval = today_interval
+        self.moving_interval = moving_interval
+        self.slow_interval = slow_interval
+        self.stale_interval = stale_interval
+        self.moving_days = moving_days
+        self.stale_days = stale_days
+        self.no_update_interval = no_update_interval
+        self.no_update_max = no_update_max
+        self._next_check = {}
+        self._misses = {}
+        self._lock = threading.Lock()
+
+    def interval_for(self, status, misses=0):
+        """Return the seconds until ``status``'s package should be fetched again"""
+        if not status.has_updates:
+            return min(self.no_update_interval * 2 ** max(misses - 1, 0), self.no_update_max)
+        if status.delivered:
+            return float("inf")
+        if status.location in TUNISIA_OFFICES:
+            return self.tunisia_interval
+        if status.is_today:
+            return self.today_interval
+        days = status.days_since(status.events[-1]) if status.events else self.stale_days
+        if days <= self.moving_days:
+            return self.moving_interval
+        if days <= self.stale_days:
+            return self.slow_interval
+        return self.stale_interval
+
+    def schedule(self, package_number, status, now=None):
+        """Record a fresh fetch of ``package_number`` and plan its next check"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if status.has_updates:
+                self._misses.pop(package_number, None)
+                misses = 0
+            else:
+                misses = self._misses.get(package_number, 0) + 1
+                self._misses[package_number] = misses
+            self._next_check[package_number] = now + self.interval_for(status, misses)
+
+    def is_due(self, package_number, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._next_check.get(package_number, 0) <= now
+
+    def due(self, packages, now=None):
+        """Return the entries of ``packages`` that should be fetched now"""
+        now = time.time() if now is None else now
+        return [pkg for pkg in packages if self.is_due(pkg["package_number"], now)]
+
+    def next_check(self, package_number):
+        """Epoch time of the next planned check, or None if never planned"""
+        with self._lock:
+            return self._next_check.get(package_number)
@@ -0,0 +1,66 @@
+import json
+import logging
+import os
+from datetime import datetime
+
+from AliExpress import PackageStatus
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+
+
+def save_snapshot(path, scan):
+    """Write the bot's latest scan (``statuses`` by package number, ``total``,
+    ``scanned_at``, ``scan_id``) to the JSON file ``path``"""
+    data = {
+        "version": VERSION,
+        "scanned_at": scan["scanned_at"].isoformat(),
+        "scan_id": scan["scan_id"],
+        "total": scan["total"],
+        "packages": [
+            {
+                "key": key,
+                "package_number": status.package_number,
+                "orders": status.orders,
+                "updates": status.updates() if status.has_updates else None,
+                "error": status.error
+            }
+            for key, status in scan["statuses"].items()
+        ]
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path):
+    """Return the scan saved by ``save_snapshot``, or None if there is none.
+
+    The statuses are classified again from their events, so "today" flags
+    and the office table are current. Their events were already notified,
+    so ``new_updates`` is 0. A missing or broken file is ignored.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+    if data.get("version") != VERSION:
+        logger.warning(f"Ignoring snapshot {path} with unknown version {data.get('version')}")
+        return None
+    statuses = {}
+    for idx, entry in enumerate(data["packages"], 1):
+        statuses[entry["key"]] = PackageStatus.from_fetch(
+            idx, entry["package_number"], entry["orders"], entry["updates"], error=entry["error"]
+        )
+    return {
+        "statuses": statuses,
+        "total": data["total"],
+        "scanned_at": datetime.fromisoformat(data["scanned_at"]),
+        "scan_id": data["scan_id"]
+    }
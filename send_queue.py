@@ -0,0 +1,202 @@
+import asyncio
+import functools
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import RetryAfter
+
+from metrics import metrics
+from upstream_guard import TokenBucket
+
+MESSAGE_CHARS = 4096  # Telegram's limit for one message
+MAX_BUTTONS = 100  # Telegram's limit for one inline keyboard
+
+
+def split_text(text, max_chars=MESSAGE_CHARS):
+    """Cut ``text`` into messages of at most ``max_chars``, at line boundaries.
+
+    Only a single line longer than a message is cut in the middle.
+    """
+    chunks = []
+    lines = []
+    size = -1
+    for line in text.split("\n"):
+        while len(line) > max_chars:
+            if lines:
+                chunks.append("\n".join(lines))
+                lines, size = [], -1
+            chunks.append(line[:max_chars])
+            line = line[max_chars:]
+        if lines and size + 1 + len(line) > max_chars:
+            chunks.append("\n".join(lines))
+            lines, size = [], -1
+        lines.append(line)
+        size += 1 + len(line)
+    if text:
+        chunks.append("\n".join(lines))
+    return chunks
+
+
+@dataclass(slots=True)
+class _Job:
+    call: object  # call(text, **kwargs) for messages, call() for anything else
+    text: str | None
+    kwargs: dict
+    batch: bool
+    message: object = None  # shared by the parts of one long message
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class SendQueue:
+    """Outbound Bot API calls, paced to stay under Telegram's flood limits.
+
+    Each chat has its own queue, drained in order by one task, so a chat's
+    messages never overtake each other while different chats are sent in
+    parallel. Every call takes a token from the chat's bucket and from the
+    global one first. A 429 RetryAfter pauses all sending for the time
+    Telegram asks and the call is tried again.
+
+    Messages queued with ``batch=True`` that are waiting for the same chat
+    are sent as one message (texts joined, buttons stacked) when they fit.
+    """
+
+    def __init__(self, global_rate=25, chat_rate=1, chat_burst=3, max_chars=MESSAGE_CHARS, max_retries=3):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chars = max_chars
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+        self._queues = {}
+        self._resume_at = 0.0
+
+    async def send(self, chat_id, send, text, /, batch=False, **kwargs):
+        """Queue ``send(text, **kwargs)`` and return the last message sent.
+
+        Long texts are split at line boundaries; a ``reply_markup`` goes on
+        the last part only. If a part fails, the parts after it are not sent
+        and its error is raised.
+        """
+        chunks = split_text(text, self.max_chars)
+        markup = kwargs.pop("reply_markup", None)
+        message = object()
+        jobs = [_Job(send, chunk, dict(kwargs), batch, message) for chunk in chunks]
+        if jobs and markup is not None:
+            jobs[-1].kwargs["reply_markup"] = markup
+        self._enqueue(chat_id, jobs)
+        result = None
+        for job in jobs:
+            result = await job.future
+        return result
+
+    async def call(self, chat_id, func, /, *args, **kwargs):
+        """Queue any other Bot API call for ``chat_id`` (e.g. an edit) and return its result"""
+        job = _Job(functools.partial(func, *args, **kwargs), None, {}, False)
+        self._enqueue(chat_id, [job])
+        return await job.future
+
+    def pending(self):
+        return sum(len(jobs) for jobs in self._queues.values())
+
+    def _enqueue(self, chat_id, jobs):
+        if not jobs:
+            return
+        if chat_id in self._queues:
+            self._queues[chat_id].extend(jobs)
+        else:
+            self._queues[chat_id] = list(jobs)
+            asyncio.get_running_loop().create_task(self._drain(chat_id))
+
+    async def _drain(self, chat_id):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                batch = self._take_batch(queue)
+                try:
+                    result = await self._send(chat_id, batch)
+                except Exception as e:
+                    for job in batch:
+                        if not job.future.done():
+                            job.future.set_exception(e)
+                    _drop_rest(queue, {job.message for job in batch if job.message is not None})
+                else:
+                    for job in batch:
+                        if not job.future.done():
+                            job.future.set_result(result)
+        finally:
+            del self._queues[chat_id]
+
+    def _take_batch(self, queue):
+        """Remove and return the next job, merged with the batchable ones after it"""
+        batch = [queue.pop(0)]
+        if not _mergeable(batch[0]):
+            return batch
+        size = len(batch[0].text)
+        buttons = _buttons(batch[0])
+        while queue and _mergeable(queue[0]):
+            job = queue[0]
+            if size + 2 + len(job.text) > self.max_chars or buttons + _buttons(job) > MAX_BUTTONS:
+                break
+            size += 2 + len(job.text)
+            buttons += _buttons(job)
+            batch.append(queue.pop(0))
+        if len(batch) > 1:
+            metrics.inc("telegram_batched_total", len(batch) - 1)
+        return batch
+
+    async def _send(self, chat_id, batch):
+        call, args, kwargs = _merge(batch)
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(max(0.0, self._resume_at - time.monotonic()))
+            await asyncio.sleep(bucket.reserve())
+            await asyncio.sleep(self.global_bucket.reserve())
+            try:
+                with metrics.timer("stage_seconds", stage="telegram_send"):
+                    return await call(*args, **kwargs)
+            except RetryAfter as e:
+                metrics.inc("telegram_retry_after_total")
+                if attempt == self.max_retries:
+                    raise
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+
+def _drop_rest(queue, messages):
+    """Cancel the queued parts of ``messages``, whose sender already got an error"""
+    kept = []
+    for job in queue:
+        if job.message in messages:
+            job.future.cancel()
+        else:
+            kept.append(job)
+    queue[:] = kept
+
+
+def _mergeable(job):
+    return job.batch and set(job.kwargs) <= {"reply_markup"}
+
+
+def _buttons(job):
+    markup = job.kwargs.get("reply_markup")
+    if markup is None:
+        return 0
+    return sum(len(row) for row in markup.inline_keyboard)
+
+
+def _merge(batch):
+    """Return ``(call, args, kwargs)`` sending the whole batch as one call"""
+    last = batch[-1]
+    if last.text is None:
+        return last.call, (), {}
+    if len(batch) == 1:
+        return last.call, (last.text,), last.kwargs
+    rows = [row for job in batch if "reply_markup" in job.kwargs for row in job.kwargs["reply_markup"].inline_keyboard]
+    kwargs = {"reply_markup": InlineKeyboardMarkup(rows)} if rows else {}
+    return last.call, ("\n\n".join(job.text for job in batch),), kwargs
@@ -1,6 +1,25 @@
+from fragment_cache import fragments
+from metrics import metrics
+
+
+@metrics.timed("stage_seconds", stage="format")
 def format_single_package_detail(package_result):
-    """Format detailed output for a single package check with full tracking table"""
-    
+    """Format detailed output for a single package check with full tracking table
+
+    The output is cached per package and only rendered again once the
+    package has a new latest event or its status changes.
+    """
+    updates = package_result.get("updates", [])
+    latest = tuple(updates[-1].values()) if isinstance(updates, list) and updates else None
+    fingerprint = (
+        latest, len(updates), package_result.get("is_today"),
+        package_result.get("delivered"), package_result.get("location")
+    )
+    key = (package_result.get("package_number", "N/A"), tuple(package_result.get("orders", [])))
+    return list(fragments.render("detail", key, fingerprint, lambda: _render_detail(package_result)))
+
+
+def _render_detail(package_result):
     output = []
     
     # Package header
@@ -1,12 +1,27 @@
 import os
+import asyncio
+import functools
 import logging
+from dataclasses import dataclass, replace
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler, MessageHandler, filters
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, CallbackQueryHandler, ExtBot, MessageHandler, filters
 from dotenv import load_dotenv
 load_dotenv()
 
-from AliExpress import fetch_package_updates, create_mobile_output, load_packages_from_file, fetch_single_package
+from AliExpress import fetch_package_updates, scan_packages, build_mobile_report, fetch_single_package, get_session, close_session, response_cache, circuit_breaker
+from location_classifier import classifier
+from metrics import metrics
+from fragment_cache import fragments
+from mobile_formatter import PAGE_CHARS, format_page, paginate
+from package_lists import PackageLists
+from package_registry import PackageRegistry, normalize, tracking_keys
+from polling_planner import PollingPlanner
+from scan_snapshot import load_snapshot, save_snapshot
+from send_queue import SendQueue
 from single_package_formatter import format_single_package_detail
 
 # Basic logging
@@ -25,14 +40,172 @@ if not TOKEN:
 if not TOKEN:
     raise RuntimeError("Telegram bot token not found. Set TELEGRAM_BOT_TOKEN or create telegram_token.txt")
 
+# Scraping runs on its own small thread pool so the event loop stays free.
+# At most SCAN_QUEUE_LIMIT jobs may be running or waiting at any time.
+SCAN_WORKERS = int(os.environ.get("SCAN_WORKERS", "2"))
+SCAN_QUEUE_LIMIT = int(os.environ.get("SCAN_QUEUE_LIMIT", "4"))
+PROGRESS_INTERVAL = 3  # seconds between progress edits
+
+_scan_executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan")
+_scan_slots = asyncio.Semaphore(SCAN_QUEUE_LIMIT)
+
+# Background polling: every POLL_INTERVAL seconds (0 disables) the packages
+# the planner considers due are fetched and chats are told about new events.
+# /checkall answers from the latest scan while it is no older than that.
+POLL_INTERVAL = int(os.environ.get("POLL_INTERVAL", "300"))
+NOTIFY_CHAT_IDS = {
+    int(chat_id) for chat_id in os.environ.get("TELEGRAM_NOTIFY_CHAT_IDS", "").split(",") if chat_id.strip()
+}
+
+_latest_scan = {}  # statuses (by package number), total, scanned_at, scan_id, restored
+_chat_reports = {}  # chat id -> (scan_id, report, pages, changed_at), built from the latest scan on demand
+_report_views = {}  # chat id -> ReportView of the report message kept up to date in that chat
+_running_scan = None  # task of the full scan in progress, shared by all callers
+_scan_listeners = []  # progress callbacks attached to the running scan
+_fanouts = set()  # notification and report edit tasks started by finished scans
+_planner = PollingPlanner()
+_subscribers = set(NOTIFY_CHAT_IDS)  # chats that get push notifications
+_registry = PackageRegistry("package_list.json")  # reloaded only when the file changes
+
+# The latest scan is saved to SNAPSHOT_FILE after every scan and loaded at
+# startup, so the first /checkall after a restart is answered at once while a
+# background scan brings it up to date ("" disables)
+SNAPSHOT_FILE = os.environ.get("TRACKER_SNAPSHOT_FILE", "scan_snapshot.json")
+
+# Each chat can keep its own list with /add and /remove; chats without one
+# see package_list.json. A scan fetches every listed number once and each
+# chat's report is built from the shared results. The SQLite file is opened
+# at startup (or on first use), not on import.
+LISTS_DB = os.environ.get("TRACKER_LISTS_DB", "package_lists.db")
+_lists = None
+
+# Reports longer than one message are shown as pages of REPORT_PAGE_SIZE
+# packages, browsed by editing a single message
+REPORT_PAGE_SIZE = int(os.environ.get("REPORT_PAGE_SIZE", "10"))
+
+# Metrics export: Prometheus text written to METRICS_FILE after every scan
+# and on /stats, and/or served on http://127.0.0.1:METRICS_PORT/metrics
+METRICS_FILE = os.environ.get("TRACKER_METRICS_FILE")
+METRICS_PORT = int(os.environ.get("TRACKER_METRICS_PORT", "0"))
+STAGES = ("network", "parse", "classify", "format", "scan", "telegram_send")
+
+# Updates are fetched by long polling unless TELEGRAM_WEBHOOK_URL is set: then
+# Telegram pushes them to <TELEGRAM_WEBHOOK_URL>/<TELEGRAM_WEBHOOK_PATH>, served
+# by python-telegram-bot's webhook server on TELEGRAM_WEBHOOK_PORT (or PORT).
+# In both modes up to CONCURRENT_UPDATES updates are handled at once.
+WEBHOOK_URL = os.environ.get("TELEGRAM_WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.environ.get("TELEGRAM_WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_LISTEN = os.environ.get("TELEGRAM_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("TELEGRAM_WEBHOOK_PORT") or os.environ.get("PORT") or "8443")
+WEBHOOK_SECRET = os.environ.get("TELEGRAM_WEBHOOK_SECRET") or None
+# With TELEGRAM_WEBHOOK_PORT set but no TELEGRAM_WEBHOOK_URL the webhook is only
+# served locally, e.g. for benchmarks/replay_updates.py: it is neither
+# registered with Telegram nor removed there. PORT alone does not do this, as
+# hosts set it for every app.
+WEBHOOK_LOCAL = not WEBHOOK_URL and bool(os.environ.get("TELEGRAM_WEBHOOK_PORT"))
+CONCURRENT_UPDATES = int(os.environ.get("TELEGRAM_CONCURRENT_UPDATES", "256"))
+
+# Everything the bot sends goes through one queue paced to Telegram's flood
+# limits: about TELEGRAM_RATE_LIMIT messages per second overall and
+# TELEGRAM_CHAT_RATE_LIMIT per chat, waiting out any 429 RetryAfter
+_outbox = SendQueue(
+    global_rate=float(os.environ.get("TELEGRAM_RATE_LIMIT", "25")),
+    chat_rate=float(os.environ.get("TELEGRAM_CHAT_RATE_LIMIT", "1")),
+    max_chars=PAGE_CHARS
+)
+
+
+class LocalWebhookBot(ExtBot):
+    """Bot of the local webhook mode: leaves the webhook registered with Telegram alone"""
+
+    async def set_webhook(self, *args, **kwargs):
+        return True
+
+    async def delete_webhook(self, *args, **kwargs):
+        return True
+
+
+class BotBusyError(Exception):
+    """Raised when the scan queue is full"""
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking scraper call on the scan pool without freezing the bot"""
+    if _scan_slots.locked():
+        raise BotBusyError("Too many checks running, please try again in a moment.")
+    async with _scan_slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_scan_executor, lambda: func(*args, **kwargs))
+
+
+@dataclass(slots=True)
+class ReportView:
+    """The last report message of a chat and what it currently shows.
+
+    After each scan the message is edited in place, and only when the text
+    or buttons of its page differ from what was last sent.
+    """
+    message_id: int
+    page: int
+    text: str | None
+    reply_markup: InlineKeyboardMarkup | None
+
+
+class ScanProgress:
+    """Edit a status message in place while a scan is running.
+
+    Packages already found in Tunisia are listed under the counter as their
+    results stream in, before the full report is ready.
+    """
+
+    def __init__(self, message, text, numbers=None):
+        self.message = message
+        self.text = text
+        self.numbers = numbers  # tracking keys of the chat's packages; others are not listed
+        self.done = 0
+        self.total = 0
+        self.arrived = []
+        self._shown = message.text
+        self._loop = asyncio.get_running_loop()
+
+    def callback(self, done, total, status):
+        # Called from scan threads: hand the status over to the event loop
+        self._loop.call_soon_threadsafe(self._add, done, total, status)
+
+    def _add(self, done, total, status):
+        self.done, self.total = done, total
+        if self.numbers is not None and normalize(status.package_number) not in self.numbers:
+            return
+        if status.location in classifier.office_names and not status.delivered:
+            today = " ✨" if status.is_today else ""
+            self.arrived.append(f"📍 {status.location}: {status.package_number}{today}")
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            if self.total:
+                lines = [f"{self.text} ({self.done}/{self.total})"] + self.arrived[-20:]
+                await self.show("\n".join(lines))
+
+    async def show(self, text):
+        if text == self._shown:
+            return
+        try:
+            await _outbox.call(self.message.chat.id, self.message.edit_text, text)
+            self._shown = text
+        except TelegramError as e:
+            logger.debug(f"Could not update progress message: {e}")
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _subscribers.add(update.effective_chat.id)
     keyboard = [
         [InlineKeyboardButton("🔄 Check All Packages", callback_data='checkall')],
         [InlineKeyboardButton("ℹ️ Help", callback_data='help')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
+    await reply(
+        update.message,
         "📦 **Welcome to Package Tracker Bot!**\n\n"
         "Use the buttons below for quick actions or commands:\n"
         "• `/checkall` - Check all packages\n"
@@ -63,73 +236,423 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         message = "📦 **Welcome to Package Tracker Bot!**\n\nUse the buttons below for quick actions or commands:\n• `/checkall` - Check all packages\n• `/check <TRACKING>` - Check specific package"
     
-    await update.message.reply_text(
+    await reply(
+        update.message,
         message,
         reply_markup=reply_markup,
         parse_mode='Markdown'
     )
 
-async def checkall(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("🔍 Checking all packages, this may take a while...")
+def scan_running():
+    return _running_scan is not None
+
+
+async def scan_all_packages(bot, progress=None, planner=None):
+    """Scan every package, store the report as the latest state and notify chats.
+
+    Concurrent callers share a single scan: whoever comes second waits for
+    the scan already running instead of starting another one, and its
+    ``progress`` callback is attached to that scan. With a ``planner`` only
+    the packages it considers due are fetched; the others come from the cache.
+    """
+    global _running_scan
+    if progress:
+        _scan_listeners.append(progress)
     try:
-        packages = load_packages_from_file()
-        logger.info(f"Loaded {len(packages)} packages")
-        with_update, no_update, mobile_output = create_mobile_output(packages, show_only_updates=True)
+        if _running_scan is None:
+            _running_scan = asyncio.create_task(_run_full_scan(bot, planner))
+            _running_scan.add_done_callback(_clear_running_scan)
+        await asyncio.shield(_running_scan)
+    finally:
+        if progress:
+            _scan_listeners.remove(progress)
+
+
+def _clear_running_scan(task):
+    global _running_scan
+    _running_scan = None
+    if not task.cancelled():
+        task.exception()  # retrieved by the awaiting handlers; avoid asyncio warnings
+
+
+def _report_scan_progress(done, total, status):
+    # Called from scan threads
+    for listener in list(_scan_listeners):
+        listener(done, total, status)
+
+
+def get_lists():
+    """Return the chats' package lists, opening LISTS_DB the first time"""
+    global _lists
+    if _lists is None:
+        _lists = PackageLists(LISTS_DB)
+    return _lists
+
+
+def default_packages():
+    """The shared package_list.json, or an empty list if there is none"""
+    return _registry.packages()
+
+
+def chat_packages(chat_id):
+    """The chat's own package list, or package_list.json if it has none"""
+    return get_lists().packages(chat_id) or default_packages()
+
+
+def scan_list():
+    """Every package of package_list.json and of the chats' lists, each number once"""
+    unique = {}
+    for pkg in default_packages() + get_lists().all_packages():
+        unique.setdefault(pkg["package_number"], pkg)
+    return list(unique.values())
+
+
+async def _run_full_scan(bot, planner):
+    packages = scan_list()
+    if planner is not None:
+        logger.info(f"Loaded {len(packages)} unique packages, {len(planner.due(packages))} due")
+    else:
+        logger.info(f"Loaded {len(packages)} unique packages")
+    statuses = await run_blocking(
+        scan_packages, packages, progress=_report_scan_progress, planner=planner
+    )
+    # A scan restored from the snapshot counts as none for notifications
+    first_scan = not _latest_scan or _latest_scan["restored"]
+    _latest_scan.update(
+        statuses={packages[s.idx - 1]["package_number"]: s for s in statuses},
+        total=len(packages),
+        scanned_at=datetime.now(),
+        scan_id=_latest_scan.get("scan_id", 0) + 1,
+        restored=False
+    )
+    # Callers waiting for the scan get its results now; notifications and
+    # report edits are paced per chat, so they go out in the background
+    fanout = asyncio.create_task(_fan_out(bot, first_scan))
+    _fanouts.add(fanout)
+    fanout.add_done_callback(_fanouts.discard)
+    export_metrics()
+    if SNAPSHOT_FILE:
+        try:
+            await asyncio.get_running_loop().run_in_executor(_scan_executor, save_snapshot, SNAPSHOT_FILE, dict(_latest_scan))
+        except OSError as e:
+            logger.warning(f"Could not save the scan snapshot to {SNAPSHOT_FILE}: {e}")
+
+
+async def _fan_out(bot, first_scan):
+    """Push the new events of the latest scan and update the report messages"""
+    try:
+        await notify_subscribers(bot, first_scan)
+        await update_report_views(bot)
     except Exception as e:
-        logger.error(f"Error in checkall: {e}", exc_info=True)
-        await update.message.reply_text(f"❌ Error: {str(e)}")
-        return
-    
-    # Extract tracking numbers ONLY from packages with updates AND not delivered (exclude no-update and delivered packages)
-    tracking_numbers = []
+        logger.error(f"Error sending the results of a scan: {e}", exc_info=True)
+
+
+def restore_snapshot():
+    """Load the scan saved before the last restart as the latest scan; True if there was one"""
+    scan = load_snapshot(SNAPSHOT_FILE) if SNAPSHOT_FILE else None
+    if scan is None:
+        return False
+    _latest_scan.update(scan, restored=True)
+    logger.info(f"Restored the scan of {scan['scanned_at']:%d/%m/%Y %H:%M} ({len(scan['statuses'])} packages)")
+    return True
+
+
+def chat_report(chat_id):
+    """Return ``(report, pages, changed_at)`` of the chat's packages in the latest scan.
+
+    Reports are built from the shared scan results the first time a chat
+    asks after each scan. Packages added since the scan are left out until
+    the next one. ``changed_at`` is the time of the first scan that gave
+    this exact report, so a scan that changed nothing leaves it as is.
+    """
+    cached = _chat_reports.get(chat_id)
+    if cached and cached[0] == _latest_scan["scan_id"]:
+        return cached[1], cached[2], cached[3]
+    statuses = []
+    for pkg in chat_packages(chat_id):
+        status = _latest_scan["statuses"].get(pkg["package_number"])
+        if status is not None:
+            statuses.append(replace(status, idx=len(statuses) + 1, orders=pkg.get("package orders", [])))
+    report = build_mobile_report(statuses)
+    pages = paginate(report.sections, REPORT_PAGE_SIZE)
+    changed_at = _latest_scan["scanned_at"]
+    if cached and cached[1].mobile_output == report.mobile_output:
+        changed_at = cached[3]
+    _chat_reports[chat_id] = (_latest_scan["scan_id"], report, pages, changed_at)
+    return report, pages, changed_at
+
+
+def package_notifications(with_update, first_scan):
+    """Build one notification per package that gained events in a scan.
+
+    On the first scan after a start, packages whose whole history is new
+    (an empty event store) are skipped so a fresh deploy does not flood the
+    chats; events added while the bot was down are still reported.
+    """
+    notifications = []
     for pkg in with_update:
-        # Skip delivered packages
-        if pkg.get("delivered", False):
+        new_count = pkg.get("new updates", 0)
+        if not new_count or not pkg["updates"]:
             continue
-        tracking_num = pkg.get("package_number")
-        if tracking_num:
-            tracking_numbers.append(tracking_num)
-    
-    # Format output text - send as plain text to avoid Markdown parsing issues
-    final = "\n".join(mobile_output)
-    
-    # Create buttons ONLY for packages with updates (max 100 buttons per message)
-    tracking_buttons = []
-    for tn in tracking_numbers[:99]:  # Telegram limit is 100 buttons
-        tracking_buttons.append([InlineKeyboardButton(f"📦 {tn}", callback_data=f"confirm_check_{tn}")])
-    
-    # Send messages with buttons on last chunk (no Markdown parsing to avoid errors)
-    chunks = [final[i:i+3500] for i in range(0, len(final), 3500)]
-    for idx, chunk in enumerate(chunks):
-        if idx == len(chunks) - 1:
-            # Add tracking buttons and refresh button
-            keyboard = tracking_buttons + [[InlineKeyboardButton("🔄 Refresh", callback_data='checkall')]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(chunk, reply_markup=reply_markup)
+        if first_scan and new_count >= len(pkg["updates"]):
+            continue
+        latest = pkg["updates"][-1]
+        lines = ["✅ DELIVERED" if pkg["delivered"] else f"🔔 {new_count} new event(s)"]
+        lines.append(f"📦 {pkg['package_number']}")
+        if pkg["orders"]:
+            lines.append(f"📝 {pkg['orders'][0]}")
+        event = latest["Type d'événement"]
+        lines.append(f"📍 {latest['Lieu']} - {event}")
+        lines.append(f"🕐 {latest['Date']}")
+        notifications.append((pkg["package_number"], "\n".join(lines)))
+    return notifications
+
+
+async def notify_subscribers(bot, first_scan):
+    """Tell each subscribed chat about new events of the packages in its list.
+
+    All notifications are queued at once, so those for the same chat are
+    batched into as few messages as fit.
+    """
+    sends = []
+    for chat_id in _subscribers | set(get_lists().chats()):
+        report, _, _ = chat_report(chat_id)
+        for tracking, text in package_notifications(report.with_update, first_scan):
+            keyboard = [[InlineKeyboardButton(f"📦 Details {tracking}", callback_data=f"check_{tracking}")]]
+            sends.append(_notify(bot, chat_id, text, InlineKeyboardMarkup(keyboard)))
+    await asyncio.gather(*sends)
+
+
+async def _notify(bot, chat_id, text, reply_markup):
+    try:
+        await _outbox.send(chat_id, functools.partial(bot.send_message, chat_id), text, batch=True, reply_markup=reply_markup)
+    except TelegramError as e:
+        metrics.inc("telegram_send_errors_total")
+        logger.warning(f"Could not notify chat {chat_id}: {e}")
+
+
+async def refresh_restored_scan(bot):
+    """Background task: replace the scan restored at startup with a fresh one"""
+    try:
+        await scan_all_packages(bot)
+    except Exception as e:
+        logger.error(f"Error refreshing the restored scan: {e}", exc_info=True)
+
+
+async def poll_packages(application):
+    """Background task: fetch due packages every POLL_INTERVAL seconds and push changes"""
+    while True:
+        try:
+            await scan_all_packages(application.bot, planner=_planner)
+        except BotBusyError:
+            logger.info("Scan queue full, skipping this background poll")
+        except Exception as e:
+            logger.error(f"Error in background poll: {e}", exc_info=True)
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def latest_scan_is_current():
+    """True if /checkall can answer from the latest scan instead of scanning now.
+
+    That is the case for a scan no older than POLL_INTERVAL, and for one
+    restored at startup, which a background scan is already refreshing.
+    With polling disabled every /checkall scans.
+    """
+    if not _latest_scan:
+        return False
+    if _latest_scan["restored"]:
+        return True
+    age = (datetime.now() - _latest_scan["scanned_at"]).total_seconds()
+    return POLL_INTERVAL > 0 and age <= POLL_INTERVAL
+
+
+async def send_checkall_report(message):
+    """Reply to ``message`` with the mobile report.
+
+    The latest scan is used while it is current (see
+    ``latest_scan_is_current``); otherwise the packages are scanned now.
+    """
+    _subscribers.add(message.chat.id)
+    if not latest_scan_is_current():
+        if scan_running():
+            status = await reply(message, "🔍 A check is already running, joining it...")
         else:
-            await update.message.reply_text(chunk)
+            status = await reply(message, "🔍 Checking all packages, this may take a while...")
+        packages = chat_packages(message.chat.id)
+        numbers = {key for pkg in packages for key in tracking_keys(pkg["package_number"])}
+        progress = ScanProgress(status, "🔍 Checking all packages...", numbers)
+        ticker = asyncio.create_task(progress.run())
+        try:
+            await scan_all_packages(message.get_bot(), progress=progress.callback)
+        except BotBusyError as e:
+            await progress.show(f"⏳ {e}")
+            return
+        except Exception as e:
+            logger.error(f"Error in checkall: {e}", exc_info=True)
+            await reply(message, f"❌ Error: {str(e)}")
+            return
+        finally:
+            ticker.cancel()
+        await progress.show(f"✅ Checked {len(packages)} packages")
 
-async def check(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not context.args:
-        await update.message.reply_text("Usage: /check <TRACKING_NUMBER>")
+    await send_report(message)
+
+
+async def send_report(message, page=0):
+    """Reply with a new report message, which becomes the one kept up to date"""
+    text, reply_markup = render_report_page(message.chat.id, page)
+    sent = await reply(message, text, reply_markup=reply_markup)
+    _report_views[message.chat.id] = ReportView(sent.message_id, page, text, reply_markup)
+
+
+async def refresh_report(query):
+    """Scan now and edit the report message in place if the chat's report changed"""
+    message = query.message
+    _subscribers.add(message.chat.id)
+    _follow_report(message)
+    try:
+        # Every chat's report message is edited after the scan; this chat's
+        # is done here so it does not wait behind the others
+        await scan_all_packages(message.get_bot())
+        await update_report_view(message.get_bot(), message.chat.id)
+    except BotBusyError as e:
+        await reply(message, f"⏳ {e}")
+    except Exception as e:
+        logger.error(f"Error in refresh: {e}", exc_info=True)
+        await reply(message, f"❌ Error: {str(e)}")
+
+
+def _follow_report(message, page=None):
+    """Make ``message`` the chat's report message if it is an older one"""
+    view = _report_views.get(message.chat.id)
+    if view is None or view.message_id != message.message_id:
+        view = ReportView(message.message_id, page or 0, message.text, message.reply_markup)
+        _report_views[message.chat.id] = view
+    return view
+
+
+async def update_report_views(bot):
+    """Bring every chat's report message up to date with the latest scan"""
+    for chat_id in list(_report_views):
+        await update_report_view(bot, chat_id)
+
+
+async def update_report_view(bot, chat_id, page=None):
+    """Edit the chat's report message to show ``page`` (default: the same page).
+
+    Nothing is sent when the text and buttons are the ones already shown,
+    so a scan costs one edit per chat whose visible section changed.
+    Returns True if the message was edited.
+    """
+    view = _report_views.get(chat_id)
+    if view is None:
+        return False
+    page = view.page if page is None else page
+    text, reply_markup = render_report_page(chat_id, page)
+    if text == view.text and reply_markup == view.reply_markup:
+        view.page = page
+        metrics.inc("telegram_edits_total", result="skipped")
+        return False
+    try:
+        await _outbox.call(
+            chat_id, bot.edit_message_text, text, chat_id=chat_id, message_id=view.message_id, reply_markup=reply_markup
+        )
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            # Deleted, or too old to edit: stop following it
+            logger.debug(f"Could not edit report message in chat {chat_id}: {e}")
+            _report_views.pop(chat_id, None)
+            return False
+        metrics.inc("telegram_edits_total", result="skipped")
+    except TelegramError as e:
+        metrics.inc("telegram_send_errors_total")
+        logger.warning(f"Could not edit report message in chat {chat_id}: {e}")
+        return False
+    else:
+        metrics.inc("telegram_edits_total", result="sent")
+    view.page, view.text, view.reply_markup = page, text, reply_markup
+    return True
+
+
+def render_report_page(chat_id, page):
+    """Return ``(text, reply_markup)`` for a page of the chat's latest report.
+
+    When the whole report fits in one message it is shown at once, with a
+    button per package. Otherwise page 0 is the summary, the other pages
+    hold up to REPORT_PAGE_SIZE packages of one section, and the keyboard
+    has previous/next, a button per section and the page's packages.
+    """
+    report, pages, changed_at = chat_report(chat_id)
+    header = [f"🕐 Last change {changed_at:%d/%m/%Y %H:%M}", ""]
+    refresh = [InlineKeyboardButton("🔄 Refresh", callback_data='refresh')]
+
+    final = "\n".join(header + report.mobile_output)
+    numbers = [n for section in report.sections for n in section.numbers]
+    if len(final) <= PAGE_CHARS and len(numbers) < 100:
+        # Buttons only for packages with updates that are not delivered
+        keyboard = [[InlineKeyboardButton(f"📦 {tn}", callback_data=f"confirm_check_{tn}")] for tn in numbers]
+        return final, InlineKeyboardMarkup(keyboard + [refresh])
+
+    page = max(0, min(page, len(pages)))
+    if page == 0:
+        lines = header + report.summary + [f"📄 {len(pages)} pages, pick a section below"]
+        numbers = []
+    else:
+        index, start, end = pages[page - 1]
+        lines = format_page(report.sections, pages, page - 1)
+        numbers = report.sections[index].numbers[start:end]
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"page_{page - 1}"))
+    nav.append(InlineKeyboardButton(f"📊 {page}/{len(pages)}", callback_data="page_0"))
+    if page < len(pages):
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"page_{page + 1}"))
+
+    # One button per section, pointing at its first page
+    first_pages = {}
+    for number, (index, _, _) in enumerate(pages, 1):
+        first_pages.setdefault(index, number)
+    section_buttons = [
+        InlineKeyboardButton(report.sections[index].label, callback_data=f"page_{number}")
+        for index, number in first_pages.items()
+    ]
+    keyboard = [nav] + [section_buttons[i:i + 3] for i in range(0, len(section_buttons), 3)]
+    keyboard += [[InlineKeyboardButton(f"📦 {tn}", callback_data=f"confirm_check_{tn}")] for tn in numbers]
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard + [refresh])
+
+
+async def show_report_page(query, page):
+    """Edit the report message in place to show ``page``"""
+    if not _latest_scan:
+        await send_checkall_report(query.message)
         return
-    tracking = context.args[0]
-    await update.message.reply_text(f"🔍 Checking {tracking}...")
+    _follow_report(query.message, page)
+    await update_report_view(query.get_bot(), query.message.chat.id, page)
+
+
+async def reply(message, text, **kwargs):
+    """Reply to ``message`` through the outbound queue and return the (last) message sent.
+
+    Texts longer than one message are split at line boundaries, with any
+    buttons on the last part.
+    """
+    return await _outbox.send(message.chat.id, message.reply_text, text, **kwargs)
+
+
+async def send_package_detail(message, tracking):
+    """Fetch one package and reply to ``message`` with its full history"""
+    await reply(message, f"🔍 Checking {tracking}...")
     
     try:
-        # Try to find package in list to get orders
-        packages = load_packages_from_file()
-        package_orders = []
-        for pkg in packages:
-            if pkg.get("package_number") == tracking or tracking in pkg.get("package_number", ""):
-                package_orders = pkg.get("package orders", [])
-                break
+        # Orders of the package (or of the "A/B" entry it is one half of)
+        package_orders = _list_orders(message.chat.id, tracking) or _registry.orders_for(tracking)
         
         # Fetch single package with full details
-        package_result = fetch_single_package(tracking, package_orders)
+        package_result = await run_blocking(fetch_single_package, tracking, package_orders)
         
         if not package_result:
-            await update.message.reply_text(f"❌ No updates found for {tracking}")
+            await reply(message, f"❌ No updates found for {tracking}")
             return
         
         # Format detailed output
@@ -137,59 +660,158 @@ async def check(update: Update, context: ContextTypes.DEFAULT_TYPE):
         final = "\n".join(detailed_output)
         
         # Send in chunks if needed (no Markdown parsing to avoid errors)
-        chunks = [final[i:i+3500] for i in range(0, len(final), 3500)]
-        for idx, chunk in enumerate(chunks):
-            if idx == len(chunks) - 1:
-                keyboard = [
-                    [InlineKeyboardButton("🔄 Check Again", callback_data=f'check_{tracking}')],
-                    [InlineKeyboardButton("📦 Check All", callback_data='checkall')],
-                    [InlineKeyboardButton("ℹ️ Help", callback_data='help')]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(chunk, reply_markup=reply_markup)
-            else:
-                await update.message.reply_text(chunk)
+        keyboard = [
+            [InlineKeyboardButton("🔄 Check Again", callback_data=f'check_{tracking}')],
+            [InlineKeyboardButton("📦 Check All", callback_data='checkall')],
+            [InlineKeyboardButton("ℹ️ Help", callback_data='help')]
+        ]
+        await reply(message, final, reply_markup=InlineKeyboardMarkup(keyboard))
+    except BotBusyError as e:
+        await reply(message, f"⏳ {e}")
     except Exception as e:
         logger.error(f"Error in check: {e}", exc_info=True)
-        await update.message.reply_text(f"❌ Error: {str(e)}")
+        await reply(message, f"❌ Error: {str(e)}")
+
+
+def _ms(seconds):
+    if seconds is None:
+        return "-"
+    return f"{seconds * 1000:.0f}ms" if seconds < 10 else f"{seconds:.1f}s"
+
+
+def format_stats():
+    """Build the /stats message from the metrics registry"""
+    lines = ["📊 BOT STATS", "━━━━━━━━━━━━━━━", ""]
+    uptime = int(datetime.now().timestamp() - metrics.started_at)
+    lines.append(f"⏳ Up for {uptime // 3600}h {uptime % 3600 // 60}m")
+    if _latest_scan:
+        lines.append(f"🕐 Last scan {_latest_scan['scanned_at']:%d/%m/%Y %H:%M}")
+    lines.append("")
+
+    lines.append("⏱️ Latency, recent p50 / p95 / p99")
+    stages = metrics.latency_summary("stage_seconds")
+    for stage in STAGES:
+        summary = stages.get((("stage", stage),))
+        if summary:
+            count, p50, p95, p99 = summary
+            lines.append(f"• {stage}: {_ms(p50)} / {_ms(p95)} / {_ms(p99)} (n={count})")
+    lines.append("")
+
+    requests_by_outcome = {dict(labels)["outcome"]: n for labels, n in metrics.counters("upstream_requests_total").items()}
+    total = sum(requests_by_outcome.values())
+    failed = total - requests_by_outcome.get("ok", 0)
+    lines.append("🌐 rapidposte")
+    lines.append(f"• Requests: {total}, errors: {failed}")
+    for outcome, n in sorted(requests_by_outcome.items()):
+        if outcome != "ok":
+            lines.append(f"  - {outcome}: {n}")
+    lines.append(f"• Retries: {metrics.counter('upstream_retries_total')}")
+    lines.append(f"• Circuit: {circuit_breaker.state}")
+    lines.append("")
+
+    hits = metrics.counter("cache_lookups_total", result="hit")
+    misses = metrics.counter("cache_lookups_total", result="miss")
+    rate = f"{hits / (hits + misses):.0%}" if hits + misses else "-"
+    cache = response_cache.stats()
+    lines.append("🗄️ Cache")
+    lines.append(f"• Hit rate: {rate} ({hits} hits, {misses} misses)")
+    lines.append(f"• Entries: {cache['entries']} (+{cache['pinned']} delivered)")
+    rendered = fragments.stats()
+    lines.append(f"• Reused fragments: {rendered['hits']}/{rendered['hits'] + rendered['misses']} ({rendered['entries']} kept)")
+    lines.append(f"• Telegram send errors: {metrics.counter('telegram_send_errors_total')}")
+    lines.append(f"• Flood waits (429): {metrics.counter('telegram_retry_after_total')}, "
+                 f"batched messages: {metrics.counter('telegram_batched_total')}, queued: {_outbox.pending()}")
+    edits = metrics.counter("telegram_edits_total", result="sent")
+    skipped = metrics.counter("telegram_edits_total", result="skipped")
+    lines.append(f"• Report edits: {edits} sent, {skipped} skipped as unchanged")
+    return lines
+
+
+def export_metrics():
+    if not METRICS_FILE:
+        return
+    try:
+        metrics.write_prometheus(METRICS_FILE)
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {METRICS_FILE}: {e}")
+
+
+async def checkall(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_checkall_report(update.message)
+
+def _list_orders(chat_id, tracking):
+    """Orders of ``tracking`` (or of the "A/B" entry it is part of) in the chat's own list"""
+    pkg = get_lists().find(chat_id, tracking)
+    return pkg["package orders"] if pkg else []
+
+async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await reply(update.message, "Usage: /add <TRACKING> [description]")
+        return
+    chat_id = update.effective_chat.id
+    tracking = normalize(context.args[0])
+    description = " ".join(context.args[1:]) or "No description"
+    is_new = get_lists().add(chat_id, tracking, [description])
+    _chat_reports.pop(chat_id, None)
+    _subscribers.add(chat_id)
+    if is_new:
+        await reply(update.message, f"✅ Added {tracking}, it will be in the next check")
+    else:
+        await reply(update.message, f"✏️ Updated the description of {tracking}")
+
+async def remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await reply(update.message, "Usage: /remove <TRACKING>")
+        return
+    chat_id = update.effective_chat.id
+    tracking = normalize(context.args[0])
+    if get_lists().remove(chat_id, tracking):
+        _chat_reports.pop(chat_id, None)
+        await reply(update.message, f"🗑️ Removed {tracking}")
+    else:
+        await reply(update.message, f"❌ {tracking} is not in your list")
+
+async def list_packages(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    packages = get_lists().packages(update.effective_chat.id)
+    if not packages:
+        await reply(
+            update.message,
+            f"You have no list of your own yet, so you see the shared list ({len(default_packages())} packages).\n"
+            "Use /add <TRACKING> [description] to start your own."
+        )
+        return
+    lines = [f"📋 Your packages ({len(packages)})", ""]
+    lines += [f"• {pkg['package_number']} - {pkg['package orders'][0]}" for pkg in packages]
+    await reply(update.message, "\n".join(lines))
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    export_metrics()
+    await reply(update.message, "\n".join(format_stats()))
+
+async def check(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await reply(update.message, "Usage: /check <TRACKING_NUMBER>")
+        return
+    await send_package_detail(update.message, context.args[0])
 
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button callbacks"""
     query = update.callback_query
+    if query.data == 'refresh':
+        # Explicit refresh runs a live scan, then edits the report in place
+        await query.answer("🔍 Checking all packages, the report updates if anything changed")
+        await refresh_report(query)
+        return
     await query.answer()  # Acknowledge the callback
     
     if query.data == 'checkall':
-        # Simulate the checkall command
-        await query.message.reply_text("🔍 Checking all packages, this may take a while...")
-        packages = load_packages_from_file()
-        with_update, no_update, mobile_output = create_mobile_output(packages, show_only_updates=True)
-        
-        # Extract tracking numbers ONLY from packages with updates AND not delivered (exclude no-update and delivered packages)
-        tracking_numbers = []
-        for pkg in with_update:
-            # Skip delivered packages
-            if pkg.get("delivered", False):
-                continue
-            tracking_num = pkg.get("package_number")
-            if tracking_num:
-                tracking_numbers.append(tracking_num)
-        
-        # Format output text - send as plain text to avoid Markdown parsing issues
-        final = "\n".join(mobile_output)
-        # Create buttons ONLY for packages with updates
-        tracking_buttons = []
-        for tn in tracking_numbers[:99]:
-            tracking_buttons.append([InlineKeyboardButton(f"📦 {tn}", callback_data=f"confirm_check_{tn}")])
-        
-        chunks = [final[i:i+3500] for i in range(0, len(final), 3500)]
-        for idx, chunk in enumerate(chunks):
-            if idx == len(chunks) - 1:
-                keyboard = tracking_buttons + [[InlineKeyboardButton("🔄 Refresh", callback_data='checkall')]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.message.reply_text(chunk, reply_markup=reply_markup)
-            else:
-                await query.message.reply_text(chunk)
+        # Same as the /checkall command
+        await send_checkall_report(query.message)
+    
+    elif query.data.startswith('page_'):
+        # Report navigation: edit the same message
+        await show_report_page(query, int(query.data.replace('page_', '')))
     
     elif query.data == 'help':
         help_text = (
@@ -197,9 +819,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "**Commands:**\n"
             "• `/start` - Start the bot and see quick actions\n"
             "• `/checkall` - Check all packages in your list\n"
-            "• `/check <TRACKING>` - Check a specific package\n\n"
+            "• `/check <TRACKING>` - Check a specific package\n"
+            "• `/add <TRACKING> [description]` - Add a package to your list\n"
+            "• `/remove <TRACKING>` - Remove a package from your list\n"
+            "• `/list` - Show your packages\n"
+            "• `/stats` - Timings, error counts and cache hit rate\n\n"
             "**Quick Actions:**\n"
             "• Use the 🔄 Refresh button to check again\n"
+            "• Long reports are split into pages: use ◀️ ▶️ or the section buttons\n"
             "• Tap any tracking number to copy it\n"
             "• All buttons are available throughout the bot\n"
         )
@@ -235,7 +862,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         # Send as new message, don't edit the original
-        await query.message.reply_text(
+        await reply(
+            query.message,
             f"Do you want to check package {tracking}?",
             reply_markup=reply_markup
         )
@@ -248,60 +876,90 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Handle individual package check from callback
         tracking = query.data.replace('check_', '')
         await query.answer()
-        await query.message.reply_text(f"🔍 Checking {tracking}...")
-        
-        try:
-            # Try to find package in list to get orders
-            packages = load_packages_from_file()
-            package_orders = []
-            for pkg in packages:
-                if pkg.get("package_number") == tracking or tracking in pkg.get("package_number", ""):
-                    package_orders = pkg.get("package orders", [])
-                    break
-            
-            # Fetch single package with full details
-            package_result = fetch_single_package(tracking, package_orders)
-            
-            if not package_result:
-                await query.message.reply_text(f"❌ No updates found for {tracking}")
-                return
-            
-            # Format detailed output
-            detailed_output = format_single_package_detail(package_result)
-            final = "\n".join(detailed_output)
-            
-            # Send in chunks if needed (always as new message, no Markdown parsing)
-            chunks = [final[i:i+3500] for i in range(0, len(final), 3500)]
-            for idx, chunk in enumerate(chunks):
-                if idx == len(chunks) - 1:
-                    keyboard = [
-                        [InlineKeyboardButton("🔄 Check Again", callback_data=f'check_{tracking}')],
-                        [InlineKeyboardButton("📦 Check All", callback_data='checkall')],
-                        [InlineKeyboardButton("ℹ️ Help", callback_data='help')]
-                    ]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await query.message.reply_text(chunk, reply_markup=reply_markup)
-                else:
-                    await query.message.reply_text(chunk)
-        except Exception as e:
-            logger.error(f"Error in check callback: {e}", exc_info=True)
-            await query.message.reply_text(f"❌ Error: {str(e)}")
+        await send_package_detail(query.message, tracking)
+
+
+async def post_init(application):
+    # Open the shared rapidposte session and the chats' lists once, before the first scan
+    get_session()
+    get_lists()
+    if METRICS_PORT:
+        application.bot_data["metrics_server"] = metrics.serve(METRICS_PORT)
+    # Answer from the last scan at once; the first poll (or a one-off scan
+    # without polling) refreshes it in the background
+    restored = restore_snapshot()
+    if POLL_INTERVAL > 0:
+        application.bot_data["poller"] = asyncio.create_task(poll_packages(application))
+    elif restored:
+        application.bot_data["refresh"] = asyncio.create_task(refresh_restored_scan(application.bot))
+
+
+async def post_stop(application):
+    for name in ("poller", "refresh"):
+        task = application.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+    for task in list(_fanouts):
+        task.cancel()
+
+
+async def post_shutdown(application):
+    global _lists
+    metrics_server = application.bot_data.pop("metrics_server", None)
+    if metrics_server:
+        metrics_server.shutdown()
+    _scan_executor.shutdown(wait=False, cancel_futures=True)
+    close_session()
+    if _lists is not None:
+        _lists.close()
+        _lists = None
 
 
 def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+    builder = ApplicationBuilder()
+    if WEBHOOK_LOCAL:
+        builder.bot(LocalWebhookBot(TOKEN))
+    else:
+        builder.token(TOKEN)
+    app = (
+        builder
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("checkall", checkall))
     app.add_handler(CommandHandler("check", check))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("add", add))
+    app.add_handler(CommandHandler("remove", remove))
+    app.add_handler(CommandHandler("list", list_packages))
     app.add_handler(CallbackQueryHandler(button_handler))
     # Handle text messages (greetings and any other text) - must be after command handlers
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    # For cloud deployment, use polling with drop_pending_updates
     logger.info("Bot starting...")
     print("Bot started. Press Ctrl-C to stop.")
-    app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL or WEBHOOK_LOCAL:
+        # Needs python-telegram-bot[webhooks]; Telegram keeps up to 100 connections open
+        logger.info(f"Receiving updates on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}"
+                    + ("" if WEBHOOK_URL else " (local only, not registered with Telegram)"))
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}" if WEBHOOK_URL else None,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=max(1, min(CONCURRENT_UPDATES, 100)),
+            drop_pending_updates=True,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        # For cloud deployment, use polling with drop_pending_updates
+        app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
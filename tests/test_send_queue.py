@@ -0,0 +1,30 @@
+import asyncio
+import unittest
+
+from telegram.error import BadRequest
+
+from send_queue import SendQueue
+
+
+class SendQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_part_drops_the_rest_of_the_message(self):
+        sent = []
+
+        async def fail(text, **kwargs):
+            sent.append(text)
+            raise BadRequest("Chat not found")
+
+        async def ok(text, **kwargs):
+            sent.append(text)
+            return text
+
+        queue = SendQueue(global_rate=0, chat_rate=0, max_chars=10)
+        with self.assertRaises(BadRequest):
+            await queue.send(1, fail, "aaaaaaaaa\nbbbbbbbbb\nccccccccc")
+        self.assertEqual(await queue.send(1, ok, "next"), "next")
+        self.assertEqual(sent, ["aaaaaaaaa", "next"])
+        self.assertEqual(queue.pending(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+from unittest import mock
+
+import requests
+
+import AliExpress
+from upstream_guard import CircuitBreaker, CircuitOpenError, RetryBudget
+
+
+def _response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = AliExpress.BASE_URL + "LP000000000CN"
+    response._content = b""
+    return response
+
+
+class FakeSession:
+    """Answers with the given status codes in turn; exceptions are raised instead"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def get(self, url, timeout=None):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return _response(outcome)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_single_trial_when_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "half-open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+    def test_trial_success_closes(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+
+    def test_trial_failure_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0)
+        for _ in range(5):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "half-open")
+        self.assertTrue(breaker.allow())
+
+
+class GetPageTest(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        for name, value in (("circuit_breaker", self.breaker), ("MAX_RETRIES", 0),
+                            ("rate_limiter", mock.Mock()), ("retry_budget", RetryBudget()),
+                            ("backoff_delay", lambda retry: 0)):
+            patcher = mock.patch.object(AliExpress, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.engine = AliExpress.FetchEngine(max_workers=1)
+        self.url = AliExpress.BASE_URL + "LP000000000CN"
+
+    def test_client_error_on_trial_ends_the_trial(self):
+        session = FakeSession(requests.ConnectionError("down"), 404, 200)
+        with self.assertRaises(requests.ConnectionError):
+            AliExpress._get_page(self.engine, session, self.url, 1)
+        self.assertEqual(self.breaker.state, "half-open")
+        with self.assertRaises(requests.HTTPError):
+            AliExpress._get_page(self.engine, session, self.url, 1)
+        self.assertEqual(self.breaker.state, "closed")
+        response = AliExpress._get_page(self.engine, session, self.url, 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.calls, 3)
+
+    def test_open_circuit_refuses_requests(self):
+        self.breaker.reset_timeout = 60
+        session = FakeSession(requests.Timeout("slow"))
+        with self.assertRaises(requests.Timeout):
+            AliExpress._get_page(self.engine, session, self.url, 1)
+        with self.assertRaises(CircuitOpenError):
+            AliExpress._get_page(self.engine, session, self.url, 1)
+        self.assertEqual(session.calls, 1)
+
+    def test_item_errors_do_not_open_the_circuit(self):
+        # Two numbers that always get a 503, each retried twice, then a healthy one
+        self.breaker.failure_threshold = 5
+        self.breaker.reset_timeout = 60
+        session = FakeSession(503, 503, 503, 503, 503, 503, 200)
+        with mock.patch.object(AliExpress, "MAX_RETRIES", 2):
+            for _ in range(2):
+                with self.assertRaises(requests.HTTPError):
+                    AliExpress._get_page(self.engine, session, self.url, 1)
+                self.assertEqual(self.breaker.state, "closed")
+            self.assertEqual(AliExpress._get_page(self.engine, session, self.url, 1).status_code, 200)
+        self.assertEqual(session.calls, 7)
+
+    def test_retries_count_as_one_failure(self):
+        self.breaker.failure_threshold = 2
+        self.breaker.reset_timeout = 60
+        session = FakeSession(*[requests.ConnectionError("down")] * 6)
+        with mock.patch.object(AliExpress, "MAX_RETRIES", 2):
+            with self.assertRaises(requests.ConnectionError):
+                AliExpress._get_page(self.engine, session, self.url, 1)
+            self.assertEqual(self.breaker.state, "closed")
+            with self.assertRaises(requests.ConnectionError):
+                AliExpress._get_page(self.engine, session, self.url, 1)
+            self.assertEqual(self.breaker.state, "open")
+        self.assertEqual(session.calls, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from location_classifier import classifier
+
+logger = logging.getLogger(__name__)
+
+
+def is_delivered(updates):
+    """Return True if a tracking history contains a "Livré" event"""
+    return bool(updates) and any(classifier.is_delivered(u["Type d'événement"]) for u in updates)
+
+
+class TrackingCache:
+    """Cache of parsed tracking pages keyed by package number.
+
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    dropped once more than ``max_entries`` are stored. Delivered packages can
+    never change again, so they are pinned: they never expire and are never
+    evicted. When ``path`` is set the cache is loaded from and saved to that
+    JSON file, so it survives restarts.
+    """
+
+    def __init__(self, ttl=300, max_entries=2000, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def get(self, package_number, max_age=None):
+        """Return ``(pkg_number, updates)`` for a fresh entry, or None.
+
+        ``max_age`` overrides the cache TTL for this lookup.
+        """
+        ttl = self.ttl if max_age is None else max_age
+        with self._lock:
+            entry = self._pinned.get(package_number)
+            if entry is None:
+                entry = self._entries.get(package_number)
+                if entry is not None and time.time() - entry["fetched_at"] > ttl:
+                    del self._entries[package_number]
+                    entry = None
+                if entry is not None:
+                    self._entries.move_to_end(package_number)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry["pkg_number"], entry["updates"]
+
+    def put(self, package_number, pkg_number, updates):
+        """Store a fetch result. ``updates`` is None for "no package update"."""
+        entry = {"pkg_number": pkg_number, "updates": updates, "fetched_at": time.time()}
+        with self._lock:
+            if is_delivered(updates):
+                self._entries.pop(package_number, None)
+                self._pinned[package_number] = entry
+                return
+            self._entries[package_number] = entry
+            self._entries.move_to_end(package_number)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, package_number):
+        with self._lock:
+            self._entries.pop(package_number, None)
+
+    def load(self):
+        """Load entries from ``path``; a missing or broken file is ignored"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache file {self.path}: {e}")
+            return
+        with self._lock:
+            self._pinned = data.get("pinned", {})
+            self._entries = OrderedDict(data.get("entries", {}))
+
+    def save(self):
+        """Write the cache to ``path`` (no-op without a backing file)"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {"pinned": dict(self._pinned), "entries": dict(self._entries)}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "pinned": len(self._pinned),
+                "hits": self.hits,
+                "misses": self.misses
+            }
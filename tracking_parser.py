@@ -0,0 +1,112 @@
+import re
+from html.parser import HTMLParser
+
+EVENTS_TABLE_ID = "200"
+HEADER_ROWS = 2
+
+# Locates the opening tag of the events table so tokenizing can start there
+_EVENTS_TABLE_START = re.compile(
+    r"""<table\b[^>]*\bid\s*=\s*["']?""" + EVENTS_TABLE_ID + r"""(?:["'\s>/])""",
+    re.IGNORECASE
+)
+
+
+class _TableFound(Exception):
+    """Raised to stop tokenizing once the events table is closed"""
+
+
+class _EventsTableParser(HTMLParser):
+    """Tokenize a page and keep only the cells of the events table.
+
+    No tree is built: text is collected straight into rows of cells while
+    inside ``<table id="200">`` and everything else is skipped. Parsing stops
+    as soon as that table is closed.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.found = False
+        self.rows = []
+        self._depth = 0  # nesting depth of <table> tags inside the events table
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if not self._depth:
+            if tag == "table" and dict(attrs).get("id") == EVENTS_TABLE_ID:
+                self.found = True
+                self._depth = 1
+            return
+        if tag == "table":
+            self._depth += 1
+        elif tag == "tr":
+            self._close_row()
+            self._row = []
+        elif tag == "td" and self._row is not None:
+            self._close_cell()
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if not self._depth:
+            return
+        if tag == "td":
+            self._close_cell()
+        elif tag == "tr":
+            self._close_row()
+        elif tag == "table":
+            self._depth -= 1
+            if not self._depth:
+                self._close_row()
+                raise _TableFound
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            # Same as BeautifulSoup's get_text(strip=True)
+            text = data.strip()
+            if text:
+                self._cell.append(text)
+
+    def _close_cell(self):
+        if self._cell is not None:
+            self._row.append("".join(self._cell))
+            self._cell = None
+
+    def _close_row(self):
+        self._close_cell()
+        if self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+
+def parse_tracking_page(html):
+    """Extract the tracking events from an ``Item_Events.asp`` page.
+
+    The rest of the page (menus, forms, scripts) is skipped: tokenizing
+    starts at the events table and stops when it is closed. Returns a list
+    of update dicts (Date, Pays, Lieu, Type d'événement) in page order, or
+    None when the page has no ``id="200"`` events table.
+    """
+    start = _EVENTS_TABLE_START.search(html)
+    if start is None:
+        return None
+
+    parser = _EventsTableParser()
+    try:
+        parser.feed(html[start.start():])
+        parser.close()
+    except _TableFound:
+        pass
+    if not parser.found:
+        return None
+
+    updates = []
+    for cols in parser.rows[HEADER_ROWS:]:
+        if len(cols) < 4:
+            continue
+        updates.append({
+            "Date": cols[0],
+            "Pays": cols[1],
+            "Lieu": cols[2],
+            "Type d'événement": cols[3]
+        })
+    return updates